@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# Headless benchmarks for the capture-to-labels pipeline.
+# Runs pane captures through the same functions used by the actions, without curses or tmux,
+# and prints per-stage timings and peak memory as JSON.
+#
+# Also measures interpreter startup and import time for the wrapper and internal processes, and
+# label assignment for large numbers of targets.
+#
+# Usage: python3 _benchmarks.py [--repeat N] [--sizes 80x24,200x60] [--unicode] [--repetitive] [--no-startup] [--output FILE] [capture.json ...]
+#
+# Capture files are JSON objects with the keys "contents" (tmux capture-pane -p output),
+# "contentsj" (capture-pane -p -J output) and "pane_size" ([width, height]).
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import copytk_actions
+
+# Pane sizes to generate synthetic captures for.  The last is scrollback-sized.
+default_sizes = [ (80, 24), (120, 40), (200, 60), (500, 150), (200, 3000) ]
+
+default_tier_exprs = copytk_actions.default_tier_exprs
+
+words = [ 'error', 'warning', 'info', 'request', 'done', 'failed', 'retry', 'worker', 'connection', 'timeout', 'build', 'the', 'of', 'and' ]
+hosts = [ 'example.com', 'api.example.org', 'github.com', 'localhost', 'docs.python.org' ]
+dirs = [ 'usr', 'local', 'lib', 'src', 'home', 'user', 'project', 'node_modules', 'build', 'tmp' ]
+exts = [ 'py', 'js', 'txt', 'log', 'json', 'so', 'c', 'h' ]
+
+def gen_word(rng):
+	return rng.choice(words)
+
+def gen_path(rng, absolute=True):
+	els = [ rng.choice(dirs) for i in range(rng.randint(1, 5)) ]
+	path = '/'.join(els) + '/' + gen_word(rng) + '.' + rng.choice(exts)
+	return '/' + path if absolute else path
+
+def gen_url(rng):
+	return 'https://' + rng.choice(hosts) + '/' + '/'.join(( gen_word(rng) for i in range(rng.randint(0, 3)) )) + '?id=' + str(rng.randint(1, 99999))
+
+def gen_ip(rng):
+	return '.'.join(( str(rng.randint(0, 255)) for i in range(4) ))
+
+def gen_line(rng, width):
+	kind = rng.randint(0, 7)
+	if kind == 0:
+		return ''
+	elif kind == 1:
+		return f'user@host:~/{rng.choice(dirs)}$ git diff {gen_path(rng, False)}'
+	elif kind == 2:
+		return '  '.join(( gen_word(rng) + '.' + rng.choice(exts) for i in range(rng.randint(2, 8)) ))
+	elif kind == 3:
+		return f'  File "{gen_path(rng)}", line {rng.randint(1, 2000)}, in {gen_word(rng)}'
+	elif kind == 4:
+		# long line that will usually wrap
+		return ' '.join(( rng.choice([ gen_word(rng), gen_url(rng), gen_path(rng), gen_ip(rng) ]) for i in range(width // 8) ))
+	else:
+		return f'2021-03-{rng.randint(1, 28):02d} 12:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d} {gen_word(rng).upper()} [{gen_word(rng)}-{rng.randint(1, 9)}] GET {gen_url(rng)} from {gen_ip(rng)} took {rng.randint(1, 999)}ms \'{gen_word(rng)}\''
+
+# Single-width glyphs common in Unicode-heavy panes: box drawing from TUIs and tree listings, and
+# powerline prompt separators (private use area)
+unicode_decorations = [ '\u2502 ', '\u251c\u2500\u2500 ', '\u2514\u2500\u2500 ', ' \ue0b0 ', '\ue0b2 \ue0a0 ', '\u2500' * 20 + ' ' ]
+
+def gen_capture(size, seed=0, unicode=False, repetitive=False):
+	# Generates a synthetic capture of exactly size[1] display lines, with wrapped lines.
+	# With unicode, half the lines start with box drawing or powerline glyphs.  With repetitive, lines are
+	# picked from a small set, like the output of a program logging the same few messages over and over.
+	width, height = size
+	rng = random.Random(seed)
+	pool = [ gen_line(rng, width) for i in range(20) ] if repetitive else None
+	disp_lines = []
+	j_lines = []
+	while len(disp_lines) < height:
+		line = rng.choice(pool) if repetitive else gen_line(rng, width)
+		if unicode and rng.random() < 0.5:
+			line = rng.choice(unicode_decorations) + line
+		line = line[:(height - len(disp_lines)) * width]
+		chunks = [ line[i:i+width] for i in range(0, max(len(line), 1), width) ]
+		# Display captures have trailing spaces removed from each display line
+		disp_lines.extend(( chunk.rstrip() for chunk in chunks ))
+		j_lines.append(line)
+	return {
+		'contents': '\n'.join(disp_lines),
+		'contentsj': '\n'.join(j_lines),
+		'pane_size': size
+	}
+
+def load_capture(fn):
+	with open(fn, 'r') as f:
+		capture = json.load(f)
+	capture['pane_size'] = tuple(capture['pane_size'])
+	return capture
+
+def make_quickcopy(pane_capture, tier_exprs, min_match_len=4, line_memo='auto'):
+	# Build a QuickCopyAction without running its constructor, which needs curses and tmux
+	qc = copytk_actions.QuickCopyAction.__new__(copytk_actions.QuickCopyAction)
+	qc.capture = pane_capture
+	qc.copy_data = pane_capture.copy_data
+	qc.copy_disp_map = pane_capture.copy_disp_map
+	qc.tier_exprs = tier_exprs
+	qc.min_match_len = min_match_len
+	qc.line_memo = line_memo
+	return qc
+
+def get_stages(capture, tier_exprs):
+	# Returns a list of (name, fn) for each stage.  Stages are run in order and may use the
+	# results of earlier stages through the state dict.
+	size = capture['pane_size']
+	state = {}
+	def copy_data():
+		state['copy_data'] = copytk_actions.strip_trailing_space(capture['contentsj'])
+	def process_lines():
+		copytk_actions.process_pane_capture_lines(capture['contents'], size[1])
+	def align():
+		state['aligninfo'] = copytk_actions.align_capture_data(capture['contents'], state['copy_data'], size)
+	def xy_idx_map():
+		copytk_actions.get_data_xy_idx_map(capture['contents'], size)
+	def find_matches():
+		state['pane_capture'] = copytk_actions.PaneCapture(None, capture)
+		state['quickcopy'] = make_quickcopy(state['pane_capture'], tier_exprs)
+		state['matches'] = state['quickcopy'].find_matches()
+	def arrange_matches():
+		state['batches'] = state['quickcopy'].arrange_matches(list(state['matches']))
+	def gen_labels():
+		copytk_actions.em_label_tables.clear()
+		copytk_actions.get_em_labels(max(len(state['matches']), 1))
+	return state, [
+		('copy_data', copy_data),
+		('process_pane_capture_lines', process_lines),
+		('align_capture_data', align),
+		('get_data_xy_idx_map', xy_idx_map),
+		('find_matches', find_matches),
+		('arrange_matches', arrange_matches),
+		('gen_em_labels', gen_labels)
+	]
+
+def bench_capture(name, capture, tier_exprs, repeat):
+	# Time each stage over several runs, then measure peak memory in a separate run since tracing slows things down
+	times = {}
+	for i in range(repeat):
+		state, stages = get_stages(capture, tier_exprs)
+		for stage_name, fn in stages:
+			t = time.perf_counter()
+			fn()
+			times.setdefault(stage_name, []).append(time.perf_counter() - t)
+	peaks = {}
+	state, stages = get_stages(capture, tier_exprs)
+	tracemalloc.start()
+	for stage_name, fn in stages:
+		tracemalloc.reset_peak()
+		base = tracemalloc.get_traced_memory()[0]
+		fn()
+		peaks[stage_name] = tracemalloc.get_traced_memory()[1] - base
+	tracemalloc.stop()
+	return {
+		'name': name,
+		'pane_size': list(capture['pane_size']),
+		'chars': len(capture['contentsj']),
+		'matches': len(state['matches']),
+		'batches': len(state['batches']),
+		'aligned': state['aligninfo'] != None,
+		'stages': {
+			stage_name: {
+				'min_s': min(times[stage_name]),
+				'mean_s': sum(times[stage_name]) / len(times[stage_name]),
+				'peak_bytes': peaks[stage_name]
+			}
+			for stage_name, fn in stages
+		}
+	}
+
+# Python code run at process startup for each process, to measure import times.  The wrapper only
+# parses its arguments and needs copytk_tmux, while the internal process also loads copytk_actions.
+startup_paths = {
+	'wrapper': 'import copytk; copytk.parse_args([ "quickcopy" ])',
+	'internal': 'import copytk, copytk_actions'
+}
+
+def bench_startup(repeat):
+	# Runs each startup path in a fresh interpreter under -X importtime, and reports the process wall time
+	# along with the total import time and the slowest modules from the last run.
+	srcdir = os.path.dirname(os.path.abspath(__file__))
+	results = {}
+	for name, code in startup_paths.items():
+		walltimes = []
+		for i in range(repeat):
+			t = time.perf_counter()
+			proc = subprocess.run([ sys.executable, '-X', 'importtime', '-c', code ], cwd=srcdir, stderr=subprocess.PIPE, check=True)
+			walltimes.append(time.perf_counter() - t)
+		# Lines look like "import time:       self [us] |  cumulative | imported package"
+		imports = []
+		for line in proc.stderr.decode('utf8').split('\n'):
+			parts = line.split('|')
+			if len(parts) != 3 or not parts[1].strip().isdigit(): continue
+			imports.append((parts[2].rstrip(), int(parts[1])))
+		# Top level imports (without leading indentation) add up to the total
+		total_us = sum(( us for module, us in imports if not module.startswith('  ') ))
+		slowest = sorted(( (module.strip(), us) for module, us in imports if not module.startswith('  ') ), key=lambda m: m[1], reverse=True)[:10]
+		results[name] = {
+			'min_s': min(walltimes),
+			'mean_s': sum(walltimes) / len(walltimes),
+			'import_s': total_us / 1000000,
+			'slowest_imports': { module: us / 1000000 for module, us in slowest }
+		}
+	return results
+
+# Numbers of label targets to benchmark label assignment for.  Easymotion in a scrollback-sized
+# pane can have tens of thousands of targets.
+default_label_counts = [ 1000, 10000, 50000, 100000 ]
+
+def bench_labels(counts, repeat):
+	# Times building a label table from scratch and from the cache, and assigning labels for a tenth as many
+	# new targets while keeping the labels of the rest (as easymotion does when labels are saved across batches)
+	results = {}
+	for n in counts:
+		cold = []
+		warm = []
+		assign = []
+		for i in range(repeat):
+			copytk_actions.em_label_tables.clear()
+			t = time.perf_counter()
+			labels = copytk_actions.get_em_labels(n)[:n]
+			cold.append(time.perf_counter() - t)
+			t = time.perf_counter()
+			copytk_actions.get_em_labels(n)
+			warm.append(time.perf_counter() - t)
+			t = time.perf_counter()
+			copytk_actions.assign_em_labels(n // 10, None, labels[n // 10:])
+			assign.append(time.perf_counter() - t)
+		results[str(n)] = {
+			'cold_min_s': min(cold),
+			'warm_min_s': min(warm),
+			'assign_min_s': min(assign)
+		}
+	return results
+
+def parse_sizes(s):
+	return [ tuple(( int(n) for n in size.split('x') )) for size in s.split(',') if size ]
+
+def main():
+	argp = argparse.ArgumentParser(description='copytk capture pipeline benchmarks')
+	argp.add_argument('--repeat', type=int, default=5, help='number of timed runs per capture')
+	argp.add_argument('--sizes', help='comma-separated synthetic pane sizes, like 80x24,200x60')
+	argp.add_argument('--no-synthetic', action='store_true', help='only benchmark the given capture files')
+	argp.add_argument('--unicode', action='store_true', help='also benchmark synthetic captures decorated with box drawing and powerline glyphs')
+	argp.add_argument('--repetitive', action='store_true', help='also benchmark synthetic captures made of a few repeated lines, like log output')
+	argp.add_argument('--no-startup', action='store_true', help='skip measuring process startup and import times')
+	argp.add_argument('--label-counts', help='comma-separated numbers of targets to benchmark label assignment for')
+	argp.add_argument('--output', help='file to write JSON results to instead of stdout')
+	argp.add_argument('captures', nargs='*', help='recorded capture JSON files')
+	bargs = argp.parse_args()
+
+	captures = []
+	if not bargs.no_synthetic:
+		sizes = parse_sizes(bargs.sizes) if bargs.sizes else default_sizes
+		captures += [ (f'synthetic-{w}x{h}', gen_capture((w, h))) for w, h in sizes ]
+		if bargs.unicode:
+			captures += [ (f'synthetic-unicode-{w}x{h}', gen_capture((w, h), unicode=True)) for w, h in sizes ]
+		if bargs.repetitive:
+			captures += [ (f'synthetic-repetitive-{w}x{h}', gen_capture((w, h), repetitive=True)) for w, h in sizes ]
+	captures += [ (fn, load_capture(fn)) for fn in bargs.captures ]
+
+	results = {
+		'python': platform.python_version(),
+		'repeat': bargs.repeat,
+		'results': []
+	}
+	if not bargs.no_startup:
+		print('benchmarking startup', file=sys.stderr)
+		results['startup'] = bench_startup(bargs.repeat)
+	label_counts = [ int(n) for n in bargs.label_counts.split(',') if n ] if bargs.label_counts != None else default_label_counts
+	if label_counts:
+		print('benchmarking labels', file=sys.stderr)
+		results['labels'] = bench_labels(label_counts, bargs.repeat)
+	for name, capture in captures:
+		print(f'benchmarking {name}', file=sys.stderr)
+		results['results'].append(bench_capture(name, capture, default_tier_exprs, bargs.repeat))
+
+	out = json.dumps(results, indent=2)
+	if bargs.output:
+		with open(bargs.output, 'w') as f:
+			f.write(out + '\n')
+	else:
+		print(out)
+
+if __name__ == '__main__':
+	main()
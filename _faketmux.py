@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+# Scriptable stand-in for a tmux server, and a harness that runs copytk modes end to end against it.
+# The fake serves canned pane info, captures and options, records every command issued, and can add
+# latency to each call to simulate a loaded server.  Curses is replaced with a fake screen that is fed
+# a scripted key sequence.
+#
+# Usage: python3 _faketmux.py [--latency 0,0.005,0.02] [--output FILE] [recording.json ...]
+#        python3 _faketmux.py --check
+# Prints the number of tmux round trips and the time to first label for each mode as JSON.
+# Given recordings made with @copytk-record-dir, replays those instead of the built in modes.
+# With --check, runs a few modes on small captures and checks the cursor and copied data they leave behind.
+
+import argparse
+import bisect
+import json
+import re
+import shlex
+import sys
+import threading
+import time
+from collections import Counter
+
+import copytk
+import copytk_actions
+import copytk_tmux
+import _benchmarks
+from copytk_widths import char_width, get_cell_offsets
+
+
+class FakePane:
+
+	def __init__(self, pane_id, window_id, session_id, size, contents='', contentsj=None, cursor=(0, 0), zoomed=False):
+		self.pane_id = pane_id
+		self.window_id = window_id
+		self.session_id = session_id
+		self.size = size
+		self.contents = contents
+		self.contentsj = contentsj if contentsj != None else contents
+		self.cursor = cursor
+		self.zoomed = zoomed
+		self.mode = ''
+		self.scroll_position = 0
+		self.command = None
+
+	def format_fields(self):
+		return {
+			'session_id': self.session_id,
+			'window_id': self.window_id,
+			'pane_id': self.pane_id,
+			'pane_width': self.size[0],
+			'pane_height': self.size[1],
+			'window_zoomed_flag': int(self.zoomed),
+			'cursor_x': self.cursor[0],
+			'cursor_y': self.cursor[1],
+			'copy_cursor_x': self.cursor[0] if self.mode else '',
+			'copy_cursor_y': self.cursor[1] if self.mode else '',
+			'pane_mode': self.mode,
+			'scroll_position': self.scroll_position if self.mode else '',
+			'history_size': 0,
+			'window_activity': 0,
+			'pid': 0,
+			'client_tty': '/dev/null'
+		}
+
+
+class FakeTmux:
+	"""Fake tmux server that can be installed as copytk_tmux.tmux_backend."""
+
+	# Option flags that take a value, for each supported command
+	value_flags = {
+		'display-message': 'tcd',
+		'capture-pane': 'tSEb',
+		'new-window': 'Ftn',
+		'split-window': 'tF',
+		'resize-pane': 'txy',
+		'swap-pane': 'st',
+		'select-window': 't',
+		'kill-window': 't',
+		'respawn-pane': 't',
+		'copy-mode': 't',
+		'send-keys': 'tN',
+		'save-buffer': 'b',
+		'delete-buffer': 'b'
+	}
+
+	def __init__(self, options=None, latency=0.0, window_size=(200, 50)):
+		self.options = dict(options or {})
+		self.latency = latency
+		self.window_size = window_size
+		self.panes = {}
+		self.calls = [] # list of arg lists, one per round trip
+		self.buffers = []
+		self.named_buffers = {} # buffers written by capture-pane -b, which aren't copies
+		self.messages = [] # (display time flag, text) of each message shown
+		self.version = '3.3a'
+		self.respawned = None # (target, command) of the last respawn-pane
+		self.fail_commands = set() # commands that fail, like a tmux error
+		self.lock = threading.Lock()
+		self.pane_ctr = 0
+		self.window_ctr = 0
+
+	def add_pane(self, size, contents='', contentsj=None, cursor=(0, 0), zoomed=False, window_id=None):
+		if window_id == None:
+			window_id = '@' + str(self.window_ctr)
+			self.window_ctr += 1
+		pane = FakePane('%' + str(self.pane_ctr), window_id, '$0', size, contents, contentsj, cursor, zoomed)
+		self.pane_ctr += 1
+		self.panes[pane.pane_id] = pane
+		return pane
+
+	def find_pane(self, target):
+		if target == None:
+			return next(iter(self.panes.values()))
+		target = target.split('.')[-1]
+		if target.startswith('%'):
+			return self.panes[target]
+		window_id = target.split(':')[-1]
+		return next(( p for p in self.panes.values() if p.window_id == window_id ))
+
+	def command_counts(self):
+		return Counter(( argset[0] for args in self.calls for argset in split_commands(args) ))
+
+	def run(self, args, sendstdin=None):
+		with self.lock:
+			self.calls.append(args)
+			if self.latency:
+				time.sleep(self.latency)
+			out = ''
+			for argset in split_commands(args):
+				flags, posargs = parse_flags(argset[1:], self.value_flags.get(argset[0], ''))
+				handler = getattr(self, '_cmd_' + argset[0].replace('-', '_'), None)
+				if handler == None or argset[0] in self.fail_commands:
+					return 1, b''
+				out += handler(flags, posargs, sendstdin) or ''
+			return 0, out.encode('utf8')
+
+	def _expand(self, fmt, pane):
+		fields = pane.format_fields()
+		fields['version'] = self.version
+		fields.update(self.options)
+		return re.sub(r'#\{([^}]+)\}', lambda m: str(fields.get(m.group(1), '')), fmt)
+
+	def _cmd_display_message(self, flags, posargs, sendstdin):
+		pane = self.find_pane(flags.get('t'))
+		if 'p' in flags:
+			return self._expand(posargs[0], pane) + '\n'
+		self.messages.append((flags.get('d'), posargs[0]))
+
+	def _cmd_capture_pane(self, flags, posargs, sendstdin):
+		pane = self.find_pane(flags.get('t'))
+		data = (pane.contentsj if 'J' in flags else pane.contents) + '\n'
+		if 'b' in flags:
+			self.named_buffers[flags['b']] = data
+			return
+		return data
+
+	def _cmd_show_options(self, flags, posargs, sendstdin):
+		return ''.join((
+			name + ' "' + value.replace('\\', '\\\\').replace('"', '\\"') + '"\n'
+			for name, value in self.options.items()
+		))
+
+	def _cmd_new_window(self, flags, posargs, sendstdin):
+		pane = self.add_pane(self.window_size)
+		if 'P' in flags:
+			return self._expand(flags.get('F', '#{session_id}:#{window_id}'), pane) + '\n'
+
+	def _cmd_split_window(self, flags, posargs, sendstdin):
+		self.add_pane(self.window_size, window_id=self.find_pane(flags.get('t')).window_id)
+
+	def _cmd_resize_pane(self, flags, posargs, sendstdin):
+		pane = self.find_pane(flags.get('t'))
+		pane.size = (int(flags.get('x', pane.size[0])), int(flags.get('y', pane.size[1])))
+
+	def _cmd_swap_pane(self, flags, posargs, sendstdin):
+		p1 = self.find_pane(flags.get('s'))
+		p2 = self.find_pane(flags.get('t'))
+		p1.window_id, p2.window_id = p2.window_id, p1.window_id
+
+	def _cmd_select_window(self, flags, posargs, sendstdin):
+		pass
+
+	def _cmd_kill_window(self, flags, posargs, sendstdin):
+		window_id = self.find_pane(flags.get('t')).window_id
+		self.panes = { pid : p for pid, p in self.panes.items() if p.window_id != window_id }
+
+	def _cmd_respawn_pane(self, flags, posargs, sendstdin):
+		self.respawned = (flags.get('t'), posargs[0])
+
+	def _cmd_copy_mode(self, flags, posargs, sendstdin):
+		self.find_pane(flags.get('t')).mode = 'copy-mode'
+
+	def _cmd_send_keys(self, flags, posargs, sendstdin):
+		# Only the copy mode commands used for cursor movement are simulated, without line wrapping
+		if not flags.get('X'): return
+		pane = self.find_pane(flags.get('t'))
+		n = int(flags.get('N', 1))
+		x, y = pane.cursor
+		command = posargs[0]
+		if command == 'top-line':
+			x, y = 0, 0
+		elif command == 'middle-line':
+			x, y = 0, (pane.size[1] - 1) // 2
+		elif command == 'bottom-line':
+			x, y = 0, pane.size[1] - 1
+		elif command == 'cursor-down':
+			y = min(y + n, pane.size[1] - 1)
+		elif command == 'cursor-up':
+			y = max(y - n, 0)
+		elif command == 'cursor-right':
+			# Copy mode steps over whole chars, so a wide char is a single move
+			line = pane.contents.split('\n')[y] if y < len(pane.contents.split('\n')) else ''
+			offsets, width = get_cell_offsets(line)
+			stops = [ offsets[i] for i, c in enumerate(line) if char_width(c) != 0 ] + list(range(width, pane.size[0]))
+			i = max(bisect.bisect_right(stops, x) - 1, 0)
+			x = stops[min(i + n, len(stops) - 1)]
+		elif command == 'goto-line':
+			pane.scroll_position = int(posargs[1])
+		pane.cursor = (x, y)
+
+	def _cmd_load_buffer(self, flags, posargs, sendstdin):
+		self.buffers.append(bytes(sendstdin).decode('utf8'))
+
+	def _cmd_set_buffer(self, flags, posargs, sendstdin):
+		self.buffers.append(posargs[-1])
+
+	def _cmd_save_buffer(self, flags, posargs, sendstdin):
+		with open(posargs[0], 'w') as f:
+			f.write(self.named_buffers[flags['b']])
+
+	def _cmd_delete_buffer(self, flags, posargs, sendstdin):
+		del self.named_buffers[flags['b']]
+
+
+def split_commands(args):
+	# Splits a tmux argument list into commands the way tmux does.  An argument ending in ';' ends a command
+	# and loses the ';', unless the ';' is escaped as '\;', which leaves a plain ';'.
+	ret = [ [] ]
+	for a in args:
+		if a.endswith('\\;'):
+			ret[-1].append(a[:-2] + ';')
+		elif a.endswith(';'):
+			if a != ';':
+				ret[-1].append(a[:-1])
+			ret.append([])
+		else:
+			ret[-1].append(a)
+	return [ argset for argset in ret if argset ]
+
+def parse_flags(args, value_flags):
+	# Minimal getopt-style parsing of tmux command flags.  Returns (dict of flags, list of positional args).
+	flags = {}
+	i = 0
+	while i < len(args) and args[i].startswith('-') and len(args[i]) > 1:
+		if args[i] == '--':
+			i += 1
+			break
+		for j, c in enumerate(args[i][1:]):
+			if c in value_flags:
+				rest = args[i][j+2:]
+				if rest:
+					flags[c] = rest
+				else:
+					i += 1
+					flags[c] = args[i]
+				break
+			flags[c] = True
+		i += 1
+	return flags, args[i:]
+
+
+class FakeScreen:
+	"""Stand-in for a curses window.  Keys are taken from a script; running out of keys cancels the action."""
+
+	def __init__(self, size, keys):
+		self.size = size # (width, height)
+		self.keys = list(keys)
+		self.start_time = time.perf_counter()
+		self.first_label_time = None
+		self.key_wait_times = []
+		self.refreshes = 0
+		self.label_drawn = False
+
+	def getmaxyx(self):
+		return (self.size[1], self.size[0])
+
+	def clear(self):
+		pass
+
+	def addstr(self, y, x, s, attr=0):
+		if attr == FakeCurses.color_pair(1):
+			self.label_drawn = True
+
+	def refresh(self):
+		self.refreshes += 1
+		if self.label_drawn and self.first_label_time == None:
+			self.first_label_time = time.perf_counter() - self.start_time
+
+	def getkey(self):
+		self.key_wait_times.append(time.perf_counter() - self.start_time)
+		if len(self.keys) == 0:
+			# Escape, the default cancel key.  Raising here wouldn't work, since getkey() catches errors from curses.
+			return '\x1b'
+		return self.keys.pop(0)
+
+
+class FakeCurses:
+	"""Replacement for the curses module that passes a FakeScreen to wrapped functions."""
+
+	COLOR_BLACK, COLOR_RED, COLOR_GREEN, COLOR_YELLOW, COLOR_BLUE, COLOR_MAGENTA, COLOR_CYAN, COLOR_WHITE = range(8)
+
+	def __init__(self, screen):
+		self.screen = screen
+
+	def wrapper(self, fn):
+		return fn(self.screen)
+
+	def curs_set(self, visibility):
+		pass
+
+	def start_color(self):
+		pass
+
+	def use_default_colors(self):
+		pass
+
+	def init_pair(self, index, fg, bg):
+		pass
+
+	@staticmethod
+	def color_pair(index):
+		return index << 8
+
+
+def default_options():
+	opts = {
+		'@copytk-quickopen-open-command': 'true',
+		'@copytk-quickopen-match-0-0': 'urls',
+		'@copytk-quickopen-match-0-1': 'abspaths'
+	}
+	for tier, exprs in enumerate(_benchmarks.default_tier_exprs):
+		for i, expr in enumerate(exprs):
+			opts[f'@copytk-quickcopy-match-{tier}-{i}'] = expr
+	return opts
+
+def reset_copytk_state():
+	copytk_actions.swap_count = 0
+	copytk_tmux.tmux_options_cache.clear()
+	copytk_actions.cleanup_tmux_commands.clear()
+	copytk_actions.cleanup_tmux_stdin = None
+	copytk_actions.cleanup_copy_backend = None
+	copytk_actions.background_tasks.clear()
+	copytk_actions.keep_run_data = False
+	copytk_actions.pane_captures.clear()
+	copytk_actions.recorded_keys.clear()
+	copytk_tmux.trace_events.clear()
+
+def run_mode(argv, capture, keys, options=None, latency=0.0, cursor=(0, 0), fake=None):
+	"""Runs a copytk command line against a fake tmux server holding the given capture.
+
+	Arguments:
+		argv -- copytk command line arguments, like [ 'quickcopy' ]
+		capture -- Dict with the pane's contents, contentsj and pane_size
+		keys -- Sequence of keys to feed to the action
+		options -- Dict of tmux options; defaults to the copytk.tmux defaults
+		latency -- Seconds of delay to add to each tmux call
+		fake -- FakeTmux to run against, instead of one made from options and latency
+
+	Returns:
+		A dict with tmux round trip counts, timings and the fake server.
+	"""
+	if fake == None:
+		fake = FakeTmux(default_options() if options == None else options, latency)
+	target_pane = fake.add_pane(capture['pane_size'], capture['contents'], capture['contentsj'], cursor)
+	screen = FakeScreen(capture['pane_size'], keys)
+	saved = (copytk_tmux.tmux_backend, copytk_tmux.tmux_command, copytk_actions.curses, copytk_actions.args)
+	copytk_tmux.tmux_backend = fake
+	# The fake server doesn't need a real tmux binary
+	copytk_tmux.tmux_command = 'tmux'
+	copytk_actions.curses = FakeCurses(screen)
+	reset_copytk_state()
+	try:
+		# Run the wrapper, then run the internal process command that it respawned in the hidden pane
+		args = copytk.parse_args(argv)
+		copytk.run_wrapper(args.action, args)
+		wrapper_calls = len(fake.calls)
+		wrapper_time = time.perf_counter() - screen.start_time
+		copytk_actions.args = copytk.parse_args(shlex.split(fake.respawned[1])[2:])
+		canceled = False
+		try:
+			copytk_actions.run_internal_action()
+		except copytk_actions.ActionCanceled:
+			canceled = True
+		finally:
+			copytk_actions.cleanup_internal_process()
+		total_time = time.perf_counter() - screen.start_time
+	finally:
+		copytk_tmux.tmux_backend, copytk_tmux.tmux_command, copytk_actions.curses, copytk_actions.args = saved
+	return {
+		'argv': argv,
+		'latency_s': latency,
+		'canceled': canceled,
+		'tmux_calls_wrapper': wrapper_calls,
+		'tmux_calls_total': len(fake.calls),
+		'tmux_commands': dict(fake.command_counts()),
+		'wrapper_s': wrapper_time,
+		'time_to_first_label_s': screen.first_label_time,
+		# Time from each key to being ready for the next one, including the redraw
+		'key_latency_s': [ dur for name, start, dur, targs in copytk_tmux.trace_events if name == 'key_latency' ],
+		'total_s': total_time,
+		'copied': fake.buffers,
+		# Final cursor position in the target pane, after any easymotion jump
+		'cursor': target_pane.cursor,
+		'fake': fake
+	}
+
+# Modes to run, with the keys to feed each one
+default_modes = [
+	([ 'easymotion-search', '--search-nkeys', '1' ], [ 'e', 'a', 'a' ]),
+	([ 'easymotion-lines' ], [ 'a', 'a' ]),
+	([ 'easycopy', '--search-nkeys', '1' ], [ 'e', 'a', 'a', 'e', 'a', 'a' ]),
+	([ 'linecopy' ], [ 'a', 'a', 'a', 'a' ]),
+	([ 'quickcopy' ], [ 'a', 'a' ]),
+	([ 'quickopen' ], [ 'a', 'a' ])
+]
+
+def load_recording(fn):
+	with open(fn, 'r') as f:
+		return json.load(f)
+
+def replay_options(options):
+	# Recorded options, minus anything that would run commands or write files outside the fake server
+	options = dict(options)
+	options['@copytk-copy-backend'] = 'load-buffer'
+	options['@copytk-quickopen-open-command'] = 'true'
+	return options
+
+def replay_recording(recording, latency=0.0):
+	# Sticky mode recordings may contain several captures; the fake pane serves the first one throughout
+	capture = {
+		'contents': recording['contents'],
+		'contentsj': recording['contentsj'],
+		'pane_size': tuple(recording['pane_size'])
+	}
+	result = run_mode(recording['argv'], capture, recording['keys'], replay_options(recording['options']), latency, tuple(recording['cursor']))
+	result['key_waits_s'] = recording['key_waits']
+	return result
+
+def make_capture(lines, size=(40, 10)):
+	# A capture of lines short enough not to wrap
+	lines = lines + [ '' ] * (size[1] - len(lines))
+	return {
+		'contents': '\n'.join(lines),
+		'contentsj': '\n'.join(lines),
+		'pane_size': size
+	}
+
+def check_wide_char_jump():
+	# An easymotion jump past wide chars lands on the matched char, which starts at cell 10 here
+	capture = make_capture([ 'abc', '日本語 ok q', 'xyz' ])
+	result = run_mode([ 'easymotion-search', '--search-nkeys', '1' ], capture, [ 'q', 'a' ])
+	return result['cursor'] == (10, 1), f'cursor {result["cursor"]}'
+
+def check_restore_after_failed_copy():
+	# A copy that fails in the cleanup batch still leaves the original pane swapped back and the hidden window gone
+	fake = FakeTmux(default_options())
+	fake.fail_commands.add('load-buffer')
+	capture = make_capture([ 'see https://example.com/foo' ])
+	try:
+		run_mode([ 'quickcopy' ], capture, [ 'a' ], fake=fake)
+		error = None
+	except Exception as ex:
+		error = ex
+	panes = sorted(( (p.pane_id, p.window_id) for p in fake.panes.values() ))
+	return error != None and panes == [ ('%0', '@0') ], f'panes {panes}, error {error}'
+
+def check_copy_message_delay():
+	# The copy message expires after at least 1 ms when the flash time is 0, and leaves out -d before tmux 3.2
+	capture = make_capture([ 'see https://example.com/foo' ])
+	delays = []
+	for version, flash_time in [ ('3.3a', '0'), ('3.1c', '0.5'), ('', '0.5') ]:
+		fake = FakeTmux(dict(default_options(), **{ '@copytk-flash-time': flash_time }))
+		fake.version = version
+		run_mode([ 'quickcopy' ], capture, [ 'a' ], fake=fake)
+		delays.append(fake.messages[0][0])
+	return delays == [ '1', None, None ], f'delays {delays}'
+
+def check_copy_trailing_semicolon():
+	# Data ending in ';' is copied whole by the set-buffer backend, both at once and deferred to cleanup, and
+	# shown whole in the copy message
+	capture = make_capture([ 'run echo hi; now' ])
+	copied = []
+	messages = []
+	for flash_mode in [ 'highlight', 'message' ]:
+		options = dict(default_options(), **{
+			'@copytk-copy-backend': 'set-buffer',
+			'@copytk-flash-mode': flash_mode,
+			'@copytk-flash-time': '0',
+			'@copytk-quickcopy-match-0-0': '(echo hi;)'
+		})
+		fake = FakeTmux(options)
+		run_mode([ 'quickcopy' ], capture, [ 'a' ], fake=fake)
+		copied += fake.buffers
+		messages += [ text for delay, text in fake.messages ]
+	ok = copied == [ 'echo hi;', 'echo hi;' ] and messages == [ 'Copied: echo hi;' ]
+	return ok, f'copied {copied}, messages {messages}'
+
+def check_mark_every_match():
+	# Marking every match in the only batch (with uppercase labels), or marking some and cycling past the last
+	# batch, copies what was marked
+	capture = make_capture([ 'see https://example.com/foo and https://example.org/bar' ])
+	options = { name : value for name, value in default_options().items() if not name.startswith('@copytk-quickcopy-match-') }
+	options['@copytk-quickcopy-match-0-0'] = 'urls'
+	copied = []
+	for keys in [ [ 'A', 'A' ], [ 'A', 'n' ] ]:
+		fake = FakeTmux(options)
+		run_mode([ 'quickcopy' ], capture, keys, fake=fake)
+		copied += fake.buffers
+	ok = copied == [ 'https://example.com/foo\nhttps://example.org/bar', 'https://example.com/foo' ]
+	return ok, f'copied {copied}'
+
+# Behaviors checked with --check; each returns (passed, detail)
+checks = [
+	check_wide_char_jump,
+	check_restore_after_failed_copy,
+	check_copy_message_delay,
+	check_copy_trailing_semicolon,
+	check_mark_every_match
+]
+
+def run_checks():
+	ok = True
+	for check in checks:
+		passed, detail = check()
+		print(f'{"ok" if passed else "FAILED"} {check.__name__}: {detail}')
+		ok = ok and passed
+	print('OK' if ok else 'FAILED')
+	return ok
+
+def main():
+	argp = argparse.ArgumentParser(description='copytk end to end runs against a fake tmux server')
+	argp.add_argument('--latency', default='0,0.005,0.02', help='comma-separated per-call latencies in seconds')
+	argp.add_argument('--size', default='80x24', help='pane size of the synthetic capture')
+	argp.add_argument('--output', help='file to write JSON results to instead of stdout')
+	argp.add_argument('--check', action='store_true', help='run the behavior checks instead of timing runs')
+	argp.add_argument('recordings', nargs='*', help='recorded sessions to replay')
+	fargs = argp.parse_args()
+
+	if fargs.check:
+		sys.exit(0 if run_checks() else 1)
+
+	capture = _benchmarks.gen_capture(_benchmarks.parse_sizes(fargs.size)[0])
+	results = []
+	for latency in [ float(l) for l in fargs.latency.split(',') ]:
+		if fargs.recordings:
+			for fn in fargs.recordings:
+				print(f'replaying {fn} with latency {latency}', file=sys.stderr)
+				result = replay_recording(load_recording(fn), latency)
+				result['recording'] = fn
+				del result['fake']
+				results.append(result)
+			continue
+		for argv, keys in default_modes:
+			print(f'running {" ".join(argv)} with latency {latency}', file=sys.stderr)
+			result = run_mode(argv, capture, keys, latency=latency)
+			del result['fake']
+			results.append(result)
+
+	out = json.dumps(results, indent=2)
+	if fargs.output:
+		with open(fargs.output, 'w') as f:
+			f.write(out + '\n')
+	else:
+		print(out)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Checks that the preset scanners in copytk_scanners.py find exactly the same (start, end) spans as
+# re.finditer() over the preset regexes, on the url test list, synthetic captures and random strings,
+# and compares their speed on inputs that make the regexes backtrack.
+#
+# Usage: python3 _scanner_check.py [--fuzz N] [--seed S]
+
+import argparse
+import random
+import re
+import sys
+import time
+
+import copytk_actions
+import copytk_scanners
+from _regex_builds import test_urls
+from _benchmarks import gen_capture, default_sizes
+
+# Pieces random strings are made of, chosen to hit each part of the url syntax and its edge cases
+fuzz_pieces = [
+	'http://', 'ftp://', 'h://', 'abcdefg://', '://', 'a', 'Z', 'q1', '_', '-', '.', '..', '/', '//', '?', '#', '&', '=',
+	'(', ')', '()', ':', '@', '%', '~', ' ', '\n', '!', ',', '[', ']', '"', "'", '✪', 'é', '1', '25', '255', '300',
+	'1.2.3.4', '8080', '123456', 'x.com', 'user@', 'user:pw@', 'a-b', ':80', '(x)', 'k=v', '&k=', '#f'
+]
+
+def regex_spans(expr, data):
+	return [ (m.start(1), m.end(1)) for m in re.finditer(expr, data) ]
+
+def check(name, data, results):
+	ok = True
+	for preset, scanner in copytk_scanners.preset_scanners.items():
+		expected = regex_spans(copytk_actions.match_expr_presets[preset], data)
+		got = list(scanner(data))
+		if got != expected:
+			ok = False
+			print(f'MISMATCH {preset} {name}: {data!r}\n  regex:   {expected}\n  scanner: {got}')
+		results[preset] = results.get(preset, 0) + len(expected)
+	return ok
+
+def gen_fuzz(rng):
+	return ''.join(( rng.choice(fuzz_pieces) for i in range(rng.randint(1, 12)) ))
+
+def time_call(fn):
+	t = time.perf_counter()
+	fn()
+	return time.perf_counter() - t
+
+def main():
+	argp = argparse.ArgumentParser(description='differential check of the preset scanners against the preset regexes')
+	argp.add_argument('--fuzz', type=int, default=200000, help='number of random strings to check')
+	argp.add_argument('--seed', type=int, default=0)
+	args = argp.parse_args()
+
+	ok = True
+	results = {}
+	# The url test list, alone, embedded in text and all together
+	for u in test_urls:
+		for data in (u, 'see ' + u + ' here', '(' + u + ')', '"' + u + '",' + u + '\n'):
+			ok = check('test url', data, results) and ok
+	ok = check('test urls', '\n'.join(test_urls), results) and ok
+	ok = check('test urls', ' '.join(test_urls), results) and ok
+	# Synthetic captures
+	for size in default_sizes:
+		capture = gen_capture(size)
+		ok = check(f'capture {size[0]}x{size[1]}', capture['contentsj'], results) and ok
+	# Random strings
+	rng = random.Random(args.seed)
+	for i in range(args.fuzz):
+		ok = check('fuzz', gen_fuzz(rng), results) and ok
+	print('Matches compared: ' + ', '.join(( f'{preset} {count}' for preset, count in results.items() )))
+
+	# Inputs that make the regexes backtrack exponentially
+	print('Backtracking inputs (seconds, regex / scanner):')
+	for preset, scanner in copytk_scanners.preset_scanners.items():
+		expr = re.compile(copytk_actions.match_expr_presets[preset])
+		for n in (8, 12, 16, 1000, 100000):
+			for tmpl in ('see http://a.com/?{}!', 'see http://a.com/#{}!', 'see http://a.com/{}!'):
+				data = tmpl.format('a&' * (n // 2) if 'com/?' in tmpl else ('(a)b' * (n // 4) if tmpl.endswith('/{}!') else 'a' * n))
+				if n <= 16:
+					t_regex = f'{time_call(lambda: list(expr.finditer(data))):.4f}'
+				else:
+					t_regex = '-'
+				t_scanner = time_call(lambda: list(scanner(data)))
+				print(f'  {preset} {tmpl.format("...")} n={n}: {t_regex} / {t_scanner:.4f}')
+
+	print('OK' if ok else 'FAILED')
+	return 0 if ok else 1
+
+if __name__ == '__main__':
+	sys.exit(main())
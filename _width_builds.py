@@ -0,0 +1,52 @@
+# Builds the display width table in copytk_widths.py from Python's unicodedata.
+# The output of this script is pasted in place of the table there.
+#
+# Widths follow what terminals (and tmux) use for wcwidth(): combining marks, format chars and Hangul medial
+# vowels and final consonants take no cells, East Asian wide and fullwidth chars (including most emoji) take
+# two, and everything else takes one.
+
+import sys
+import unicodedata
+
+# Blocks where unassigned code points default to wide
+cjk_reserved = [ (0x3400, 0x4dbf), (0x4e00, 0x9fff), (0xf900, 0xfaff), (0x20000, 0x2fffd), (0x30000, 0x3fffd) ]
+
+def char_width(cp):
+	c = chr(cp)
+	if cp == 0x00ad:
+		# Soft hyphen is shown
+		return 1
+	if 0x1160 <= cp <= 0x11ff or cp == 0x200b:
+		return 0
+	category = unicodedata.category(c)
+	if category in ('Mn', 'Me', 'Cf'):
+		return 0
+	if category == 'Cn':
+		# Unassigned code points are only wide in the blocks reserved for CJK ideographs
+		return 2 if any(( lo <= cp <= hi for lo, hi in cjk_reserved )) else 1
+	if unicodedata.east_asian_width(c) in ('W', 'F'):
+		return 2
+	return 1
+
+def make_width_table():
+	# Returns the code points where the width changes, and the width from each of them on
+	starts = []
+	widths = []
+	for cp in range(sys.maxunicode + 1):
+		w = char_width(cp)
+		if len(widths) == 0 or widths[-1] != w:
+			starts.append(cp)
+			widths.append(w)
+	return starts, widths
+
+def print_table(name, values, fmt, per_line=12):
+	print(f'{name} = [')
+	for i in range(0, len(values), per_line):
+		print('\t' + ', '.join(( fmt(v) for v in values[i:i+per_line] )) + ',')
+	print(']')
+
+if __name__ == '__main__':
+	starts, widths = make_width_table()
+	print(f'# Generated by _width_builds.py from Unicode {unicodedata.unidata_version}')
+	print_table('width_starts', starts, lambda v: f'0x{v:05x}')
+	print_table('width_values', widths, str, 40)
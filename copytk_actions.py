@@ -0,0 +1,2145 @@
+# Tmux Copy Toolkit
+# (C) Chris Breneman 2021
+#
+# The actions run in the hidden pane, and the matching, labeling and copying they are built on.
+# Only the internal process (and the stats command) imports this; the wrapper does not need it.
+
+import os
+import os.path
+import re
+import curses
+import itertools
+import collections
+import bisect
+import io
+import math
+import subprocess
+from datetime import datetime
+import time
+import platform
+import threading
+import base64
+import shlex
+import json
+import marshal
+import stat
+
+from copytk_tmux import *
+from copytk_scanners import preset_scanners
+from copytk_widths import char_width, get_cell_offsets, cell_slice, cell_ljust, cell_char_count
+
+# Parsed command line arguments; set by copytk.main()
+args = None
+
+# strings that can be used to map to regexes in the quickcopy matches
+match_expr_presets = {
+	# matches common types of urls and things that look like urls
+	'urls': r'(?:^|[][\s:=,#"{}()'+"'"+r'])([a-zA-Z][a-zA-Z0-9]{1,5}://(?:[a-zA-Z0-9_]+(?::[a-zA-Z0-9_-]+)?@)?(?:(?:[a-zA-Z0-9][\w-]*\.)*[a-zA-Z][\w-]*|(?:[0-2]?[0-9]{1,2}\.){3}[0-2]?[0-9]{1,2})(?::[0-9]{1,5})?(?:/(?:[\w.~%/&-]+|(?:[\w.~%/&-]*\([\w.~%/&-]*\)[\w.~%/&-]*)+)?/?)?(?:\?(?:(?:[\w.~%/&-]+|(?:[\w.~%/&-]*\([\w.~%/&-]*\)[\w.~%/&-]*)+)+(?:=(?:[\w.~%/&-]+|(?:[\w.~%/&-]*\([\w.~%/&-]*\)[\w.~%/&-]*)+)?)?&)*(?:(?:[\w.~%/&-]+|(?:[\w.~%/&-]*\([\w.~%/&-]*\)[\w.~%/&-]*)+)+(?:=(?:[\w.~%/&-]+|(?:[\w.~%/&-]*\([\w.~%/&-]*\)[\w.~%/&-]*)+)?)?)?)?(?:#(?:(?:[\w.~%/&-]+|(?:[\w.~%/&-]*\([\w.~%/&-]*\)[\w.~%/&-]*)+)+(?:=(?:[\w.~%/&-]+|(?:[\w.~%/&-]*\([\w.~%/&-]*\)[\w.~%/&-]*)+)?)?&)*(?:(?:[\w.~%/&-]+|(?:[\w.~%/&-]*\([\w.~%/&-]*\)[\w.~%/&-]*)+)+(?:=(?:[\w.~%/&-]+|(?:[\w.~%/&-]*\([\w.~%/&-]*\)[\w.~%/&-]*)+)?)?)?)?)(?:$|[][\s:=,#"{}()'+"'"+r'])',
+	# Unix and window style absolute paths
+	'abspaths': r'(?:^|[][\s:=,#$"{}<>()`'+"'"+r'])((?:/|~/|[A-Z]:[\\/])(?:(?:(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)|[a-zA-Z0-9_-]{1,60}\\? [a-zA-Z0-9_-]{1,60})[\\/])*(?:(?:(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)|[a-zA-Z0-9_-]{1,60}\\? [a-zA-Z0-9_-]{1,60})\.[a-zA-Z0-9]{1,6}|(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)[\\/]?))(?:$|[][\s:=,#$"{}<>()`'+"'"+r'])',
+	# Absolute or relative paths
+	'paths': r'(?:^|[][\s:=,#$"{}<>()`'+"'"+r'])((?:(?:/|~/|[A-Z]:[\\/])(?:(?:(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)|[a-zA-Z0-9_-]{1,60}\\? [a-zA-Z0-9_-]{1,60})[\\/])*(?:(?:(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)|[a-zA-Z0-9_-]{1,60}\\? [a-zA-Z0-9_-]{1,60})\.[a-zA-Z0-9]{1,6}|(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)[\\/]?)|(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)[\\/](?:(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)[\\/]?|(?:(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)|[a-zA-Z0-9_-]{1,60}\\? [a-zA-Z0-9_-]{1,60})\.[a-zA-Z0-9]{1,6})|(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)[\\/](?:(?:(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)|[a-zA-Z0-9_-]{1,60}\\? [a-zA-Z0-9_-]{1,60})[\\/])+(?:(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)[\\/]?|(?:(?:[a-zA-Z0-9_-]{1,80}|\.|\.\.)|[a-zA-Z0-9_-]{1,60}\\? [a-zA-Z0-9_-]{1,60})\.[a-zA-Z0-9]{1,6})))(?:$|[][\s:=,#$"{}<>()`'+"'"+r'])',
+	# Isolated filenames without paths
+	'filenames': r'(?:^|[][\s:=,#$"{}<>()`/'+"'"+r'])([a-zA-Z0-9_-]{1,80}\.[a-zA-Z][a-zA-Z0-9]{0,5})(?:$|[][\s:=,#$"{}<>()`'+"'"+r'])',
+}
+
+try:
+	from re import _parser as sre_parse
+except ImportError:
+	import sre_parse
+
+# Categories of chars that include a newline
+newline_categories = ( 'CATEGORY_SPACE', 'CATEGORY_NOT_DIGIT', 'CATEGORY_NOT_WORD', 'CATEGORY_LINEBREAK' )
+
+def _set_has_newline(items):
+	# Whether a parsed [...] set matches a newline
+	negate = False
+	found = False
+	for op, av in items:
+		op = str(op)
+		if op == 'NEGATE':
+			negate = True
+		elif op == 'LITERAL':
+			found = found or av == 10
+		elif op == 'RANGE':
+			found = found or av[0] <= 10 <= av[1]
+		elif op == 'CATEGORY':
+			found = found or str(av) in newline_categories
+		else:
+			return True
+	return found != negate
+
+def _is_line_local(items, flags):
+	# Whether nothing in a parsed pattern can match a newline (so no match, lookahead or lookbehind reaches past
+	# the line it starts on) or tell the start or end of a line from the start or end of the string
+	for op, av in items:
+		op = str(op)
+		if op == 'LITERAL':
+			ok = av != 10
+		elif op == 'NOT_LITERAL':
+			ok = av == 10
+		elif op == 'ANY':
+			ok = not flags & re.DOTALL
+		elif op == 'IN':
+			ok = not _set_has_newline(av)
+		elif op == 'AT':
+			# ^ and $ are only the same per line in multiline mode.  \B differs on empty lines.
+			at = str(av)
+			ok = at == 'AT_BOUNDARY' or (at in ('AT_BEGINNING', 'AT_END') and flags & re.MULTILINE)
+		elif op == 'SUBPATTERN':
+			group, add_flags, del_flags, p = av
+			ok = _is_line_local(p, (flags | add_flags) & ~del_flags)
+		elif op == 'BRANCH':
+			ok = all(( _is_line_local(p, flags) for p in av[1] ))
+		elif op in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+			ok = _is_line_local(av[2], flags)
+		elif op in ('ASSERT', 'ASSERT_NOT'):
+			ok = _is_line_local(av[1], flags)
+		elif op == 'ATOMIC_GROUP':
+			ok = _is_line_local(av, flags)
+		elif op == 'GROUPREF_EXISTS':
+			ok = _is_line_local(av[1], flags) and (av[2] == None or _is_line_local(av[2], flags))
+		else:
+			# Backreferences only match text already matched on the line; anything else is unknown
+			ok = op == 'GROUPREF'
+		if not ok:
+			return False
+	return True
+
+line_local_exprs = {}
+
+def expr_is_line_local(expr, flags=0):
+	# Whether re.finditer(expr) over text finds exactly the matches of running it on each line on its own
+	key = ( expr, flags )
+	if key not in line_local_exprs:
+		try:
+			parsed = sre_parse.parse(expr, flags)
+			state = getattr(parsed, 'state', None) or parsed.pattern
+			line_local_exprs[key] = _is_line_local(parsed, state.flags)
+		except Exception:
+			line_local_exprs[key] = False
+	return line_local_exprs[key]
+
+def match_span(match):
+	# Span of the first group of a match, or the whole match if there are no groups
+	try:
+		return ( match.start(1), match.end(1) )
+	except IndexError:
+		return ( match.start(0), match.end(0) )
+
+# Relative spans of the matches in recently seen lines, keyed by (expr, flags, line), least recently used first
+line_match_cache = collections.OrderedDict()
+line_match_cache_size = 20000
+# Exprs are matched per line when at most this fraction of the lines in the pane are distinct
+line_memo_max_distinct = 0.25
+
+def find_line_memo_matches(expr, flags, lines):
+	# Yields the same spans as re.finditer(expr, '\n'.join(lines), flags) for a line-local expr, running it only
+	# once for each distinct line and offsetting the cached spans for the others
+	rx = re.compile(expr, flags)
+	seen = {}
+	offset = 0
+	for line in lines:
+		spans = seen.get(line)
+		if spans == None:
+			key = ( expr, flags, line )
+			spans = line_match_cache.get(key)
+			if spans == None:
+				spans = tuple(( match_span(m) for m in rx.finditer(line) ))
+				line_match_cache[key] = spans
+				if len(line_match_cache) > line_match_cache_size:
+					line_match_cache.popitem(last=False)
+			else:
+				line_match_cache.move_to_end(key)
+			seen[line] = spans
+		for start, end in spans:
+			if start < 0:
+				# Group 1 didn't take part in the match
+				yield ( -1, -1 )
+			else:
+				yield ( start + offset, end + offset )
+		offset += len(line) + 1
+
+# The default quickcopy matches set in copytk.tmux
+default_tier_exprs = [
+	[ 'urls', 'abspaths' ],
+	[ 'paths', 'filenames', r'(?:^|\W)([0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3})(?:$|\W)' ],
+	[ r'(?m)^[^\n]{0,80}\$ ([a-zA-Z][a-zA-Z0-9_-]*(?: [^\n]*)?)$' ],
+	[ r'-?[0-9]+(?:\.[0-9]+)?(?:[eE]-?[0-9]+)?', r'"([^"\n]*)"', r"'([^'\n]*)'" ],
+	[ 'lines' ]
+]
+
+def get_stats_file(stats_file=None):
+	# The stats file given on the command line, then COPYTK_STATS_FILE, then the @copytk-stats-file option
+	stats_file = stats_file or os.environ.get('COPYTK_STATS_FILE') or get_tmux_option('@copytk-stats-file')
+	return os.path.expanduser(stats_file or '')
+
+def make_stats_record():
+	# Summarizes the buffered trace events of this internal process into a compact stats record
+	phases = {}
+	exprs = {}
+	tmux_calls = args.wrapper_tmux_calls or 0
+	matches = None
+	pane_size = None
+	first_label_time = None
+	last_key_time = None
+	key_to_copy = None
+	for name, start, dur, targs in trace_events:
+		if dur != None:
+			phases[name] = phases.get(name, 0) + dur
+		if name == 'tmux':
+			tmux_calls += 1
+		elif name == 'match_expr':
+			exprs[targs['expr']] = exprs.get(targs['expr'], 0) + dur
+		elif name == 'align':
+			pane_size = targs['size']
+		elif name == 'arrange_matches' or name == 'locations':
+			matches = targs.get('matches', targs.get('count'))
+		elif name == 'first_label_draw' and first_label_time == None:
+			# Measured from the last key before the labels (the search chars for easymotion-search and easycopy),
+			# otherwise from the start of the wrapper process
+			first_label_time = start - (last_key_time if last_key_time != None else args.start_time - trace_clock_offset)
+		elif name == 'key':
+			last_key_time = start
+		elif name in ('copy', 'move_cursor') and key_to_copy == None and last_key_time != None:
+			# For easymotion, the cursor move counts as the "copy"
+			key_to_copy = start + dur - last_key_time
+	return {
+		'time': time.time(),
+		'action': args.action,
+		'pane_size': pane_size,
+		'matches': matches,
+		'tmux_calls': tmux_calls,
+		'time_to_first_label': first_label_time,
+		'key_to_copy': key_to_copy,
+		'phases': { name : round(dur, 6) for name, dur in phases.items() },
+		'exprs': { expr : round(dur, 6) for expr, dur in exprs.items() }
+	}
+
+def append_stats_record(record, stats_file, max_kb=512):
+	# The stats file is a bounded ring of JSON lines.  When the file reaches half the maximum size it is
+	# rotated to a .1 file, replacing the previous one, so the pair never exceeds the maximum.
+	os.makedirs(os.path.dirname(stats_file) or '.', exist_ok=True)
+	try:
+		if os.path.getsize(stats_file) > max_kb * 1024 // 2:
+			os.replace(stats_file, stats_file + '.1')
+	except FileNotFoundError:
+		pass
+	with open(stats_file, 'a') as f:
+		f.write(json.dumps(record) + '\n')
+
+def read_stats_records(stats_file):
+	records = []
+	for fn in (stats_file + '.1', stats_file):
+		if not os.path.exists(fn): continue
+		with open(fn, 'r') as f:
+			for line in f:
+				try:
+					records.append(json.loads(line))
+				except ValueError:
+					pass # partially written line
+	return records
+
+def percentile(values, p):
+	# Nearest-rank percentile of a sorted list
+	if len(values) == 0: return None
+	return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+def print_stats(stats_file, nexprs=10):
+	records = read_stats_records(stats_file)
+	if len(records) == 0:
+		print(f'No stats recorded in {stats_file}')
+		return
+	def fmt_ms(v):
+		return '-' if v == None else f'{v * 1000:.1f}'
+	def fmt_pcts(values):
+		values = sorted(( v for v in values if v != None ))
+		return '/'.join(( fmt_ms(percentile(values, p)) for p in (50, 95, 99) ))
+	print(f'{len(records)} records from {stats_file}\n')
+	print(f'{"action":<22} {"count":>6}  {"first label p50/p95/p99 ms":<30} {"key to copy p50/p95/p99 ms":<30}')
+	for action in sorted(set(( r['action'] for r in records ))):
+		recs = [ r for r in records if r['action'] == action ]
+		print(f'{action:<22} {len(recs):>6}  {fmt_pcts(r["time_to_first_label"] for r in recs):<30} {fmt_pcts(r["key_to_copy"] for r in recs):<30}')
+	# Slowest expressions across quickcopy/quickopen runs, by mean time
+	exprtimes = {}
+	for r in records:
+		for expr, dur in r.get('exprs', {}).items():
+			exprtimes.setdefault(expr, []).append(dur)
+	if len(exprtimes) == 0: return
+	print('\nSlowest quickcopy expressions:')
+	print(f'{"mean ms":>8} {"p95 ms":>8} {"runs":>6}  expression')
+	slowest = sorted(exprtimes.items(), key=lambda item: sum(item[1]) / len(item[1]), reverse=True)[:nexprs]
+	for expr, durs in slowest:
+		durs.sort()
+		print(f'{fmt_ms(sum(durs) / len(durs)):>8} {fmt_ms(percentile(durs, 95)):>8} {len(durs):>6}  {expr}')
+
+# Whether to keep the captures and keys below.  Only set when profiling or recording, since otherwise nothing
+# reads them and each capture would stay in memory until exit.
+keep_run_data = False
+# PaneCaptures made by this process, kept so profiling and recording runs can save the captured contents
+pane_captures = []
+# Keys read by actions in this process, as (key, seconds spent waiting for the key), for recordings
+recorded_keys = []
+
+def make_profile_run_dir(profile_dir):
+	run_dir = os.path.join(os.path.expanduser(profile_dir), f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{os.getpid()}')
+	os.makedirs(run_dir, exist_ok=True)
+	return run_dir
+
+class Profiler:
+	"""Context manager that runs a block under cProfile and/or tracemalloc and writes the results to a directory.
+
+	Arguments:
+		modes -- Comma-separated list of 'cprofile' and 'tracemalloc', or 'on'/'all' for both
+		run_dir -- Directory to write results to
+		role -- Prefix for result file names, 'wrapper' or 'internal'
+	"""
+
+	def __init__(self, modes, run_dir, role):
+		modes = [ m.strip() for m in modes.split(',') ]
+		if 'on' in modes or 'all' in modes:
+			modes = [ 'cprofile', 'tracemalloc' ]
+		self.modes = modes
+		self.run_dir = run_dir
+		self.role = role
+
+	def __enter__(self):
+		global keep_run_data
+		keep_run_data = True
+		if 'tracemalloc' in self.modes:
+			import tracemalloc
+			tracemalloc.start(25)
+		if 'cprofile' in self.modes:
+			import cProfile
+			self.profile = cProfile.Profile()
+			self.profile.enable()
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		if 'cprofile' in self.modes:
+			import pstats
+			self.profile.disable()
+			self.profile.dump_stats(os.path.join(self.run_dir, self.role + '.prof'))
+			with open(os.path.join(self.run_dir, self.role + '-cprofile.txt'), 'w') as f:
+				pstats.Stats(self.profile, stream=f).sort_stats('cumulative').print_stats(60)
+		if 'tracemalloc' in self.modes:
+			import tracemalloc
+			snapshot = tracemalloc.take_snapshot()
+			current, peak = tracemalloc.get_traced_memory()
+			tracemalloc.stop()
+			with open(os.path.join(self.run_dir, self.role + '-tracemalloc.txt'), 'w') as f:
+				f.write(f'current: {current} bytes\npeak: {peak} bytes\n\n')
+				for st in snapshot.statistics('lineno')[:50]:
+					f.write(str(st) + '\n')
+		# Save captured pane contents in the format read by _benchmarks.py
+		for i, capture in enumerate(pane_captures):
+			fn = 'capture.json' if i == 0 else f'capture-{i}.json'
+			with open(os.path.join(self.run_dir, fn), 'w') as f:
+				json.dump({
+					'action': args.action,
+					'contents': capture.orig_pane['contents'],
+					'contentsj': capture.orig_pane['contentsj'],
+					'pane_size': capture.orig_pane['pane_size']
+				}, f)
+
+def get_record_dir():
+	return os.path.expanduser(os.environ.get('COPYTK_RECORD_DIR') or get_tmux_option('@copytk-record-dir') or '')
+
+def write_recording(record_dir):
+	# Saves everything needed to replay this run with _faketmux.py --replay: the command line, pane info and
+	# captures, the effective options, and the keys pressed with how long each took to arrive.  The first
+	# capture is also stored at the top level in the format read by _benchmarks.py.
+	if len(pane_captures) == 0: return
+	panes = [ capture.orig_pane for capture in pane_captures ]
+	argv = [ args.action ]
+	if args.search_nkeys:
+		argv += [ '--search-nkeys', args.search_nkeys ]
+	if args.search_direction:
+		argv += [ '--search-direction', args.search_direction ]
+	if args.sticky:
+		argv += [ '--sticky' ]
+	os.makedirs(record_dir, exist_ok=True)
+	fn = os.path.join(record_dir, f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{args.action}.json')
+	with open(fn, 'w') as f:
+		json.dump({
+			'argv': argv,
+			'contents': panes[0]['contents'],
+			'contentsj': panes[0]['contentsj'],
+			'pane_size': panes[0]['pane_size'],
+			'cursor': panes[0]['cursor'],
+			'panes': panes,
+			'options': fetch_tmux_options(),
+			'keys': [ key for key, wait in recorded_keys ],
+			'key_waits': [ round(wait, 4) for key, wait in recorded_keys ]
+		}, f)
+
+def get_tmux_option_key_curses(name, default=None, optmode='g', aslist=False):
+	remap = {
+		'Escape': '\x1b',
+		'Enter': '\n',
+		'Space': ' '
+	}
+	v = get_tmux_option(name, default=default, optmode=optmode, aslist=aslist)
+	if aslist:
+		# also allow space-separated list
+		return [ remap.get(s, s) for k in v for s in k.split(' ') ]
+	else:
+		return remap.get(v, v)
+
+def get_tmux_option_color_pair_curses(name, default_fg=-1, default_bg=-1):
+	strmap = {
+		'none': -1,
+		'black': curses.COLOR_BLACK,
+		'red': curses.COLOR_RED,
+		'green': curses.COLOR_GREEN,
+		'yellow': curses.COLOR_YELLOW,
+		'blue': curses.COLOR_BLUE,
+		'magenta': curses.COLOR_MAGENTA,
+		'cyan': curses.COLOR_CYAN,
+		'white': curses.COLOR_WHITE
+	}
+	v = get_tmux_option(name)
+	if v == None:
+		return (default_fg, default_bg)
+	parts = v.lower().split(':')
+	if parts[0] not in strmap:
+		raise Exception(f'Invalid color {parts[0]}')
+	fg = strmap[parts[0]]
+	if len(parts) > 1:
+		if parts[1] not in strmap:
+			raise Exception(f'Invalid color {parts[1]}')
+		bg = strmap[parts[1]]
+	else:
+		bg = default_bg
+	return (fg, bg)
+
+swap_count = 0
+def swap_hidden_pane_args():
+	# Returns the tmux args to swap the hidden pane in or out, and updates the swap state
+	global swap_count
+	if args.swap_mode == 'pane-swap':
+		# Swap target pane and hidden pane
+		t1 = args.t
+		t2 = args.hidden_t
+		tmuxargs = [ 'swap-pane', '-s', t2, '-t', t1 ]
+	else:
+		# Switch to either the hidden window or the orig window
+		if swap_count % 2 == 0:
+			selectwin = args.hidden_window
+		else:
+			selectwin = args.orig_window
+		tmuxargs = [ 'select-window', '-t', selectwin ]
+	swap_count += 1
+	return tmuxargs
+
+def swap_hidden_pane(show_hidden=None):
+	if show_hidden == True and swap_count % 2 == 1:
+		return
+	if show_hidden == False and swap_count % 2 == 0:
+		return
+	runtmux(swap_hidden_pane_args())
+
+def move_tmux_cursor(pos, target, gotocopy=True, scroll_position=None, pane_height=None): # (x, y)
+	# Moves the copy mode cursor to a position on the screen as it was captured.  The view is first restored to
+	# the captured scroll position with goto-line, then the cursor starts at whichever of the top, middle or
+	# bottom lines is closest, so tmux steps the cursor at most half the pane height plus the column.
+	# Without the pane height, it falls back to stepping down from the top line.  The x position is a count of
+	# chars from the start of the line rather than a cell column, since cursor-right steps over wide chars whole.
+	log('move cursor to: ' + str(pos), time=True)
+	tmuxcmds = []
+	if gotocopy:
+		tmuxcmds.append([ 'copy-mode', '-t', target ])
+	if scroll_position != None:
+		tmuxcmds.append([ 'send-keys', '-X', '-t', target, 'goto-line', str(scroll_position) ])
+	if pane_height == None:
+		anchors = [ ('top-line', 0) ]
+	else:
+		anchors = [ ('top-line', 0), ('middle-line', (pane_height - 1) // 2), ('bottom-line', pane_height - 1) ]
+	anchor, anchor_y = min(anchors, key=lambda a: abs(pos[1] - a[1]))
+	tmuxcmds.append([ 'send-keys', '-X', '-t', target, anchor ])
+	if pos[1] > anchor_y:
+		tmuxcmds.append([ 'send-keys', '-X', '-t', target, '-N', str(pos[1] - anchor_y), 'cursor-down' ])
+	elif pos[1] < anchor_y:
+		tmuxcmds.append([ 'send-keys', '-X', '-t', target, '-N', str(anchor_y - pos[1]), 'cursor-up' ])
+	#tmuxcmds.append([ 'send-keys', '-X', '-t', target, 'start-of-line' ]) # Was breaking when on a wrapped line
+	if pos[0] > 0:
+		tmuxcmds.append([ 'send-keys', '-X', '-t', target, '-N', str(pos[0]), 'cursor-right' ])
+	with trace_span('move_cursor'):
+		runtmuxmulti(tmuxcmds)
+
+# tmux commands (and stdin for them) to run in one batch at cleanup, just before the original pane is restored
+cleanup_tmux_commands = []
+cleanup_tmux_stdin = None
+# Copy backend of a copy queued in the cleanup commands, if any
+cleanup_copy_backend = None
+
+def flush_cleanup_tmux_commands():
+	# Runs the queued cleanup commands in a single tmux invocation.  If they include a copy, the invocation is
+	# traced as the copy, so stats time the copy from when it is actually done rather than queued.
+	global cleanup_tmux_stdin, cleanup_copy_backend
+	tmuxcmds = list(cleanup_tmux_commands)
+	sendstdin = cleanup_tmux_stdin
+	backend = cleanup_copy_backend
+	cleanup_tmux_commands.clear()
+	cleanup_tmux_stdin = None
+	cleanup_copy_backend = None
+	if backend != None:
+		with trace_span('copy', backend=backend):
+			runtmuxmulti(tmuxcmds, sendstdin=sendstdin)
+	else:
+		runtmuxmulti(tmuxcmds, sendstdin=sendstdin)
+
+def cleanup_internal_process():
+	# The original pane is restored in a separate invocation after the queued commands, since tmux skips the
+	# rest of a command list when one fails, and a failed copy or message must not leave the hidden pane
+	# swapped in.  The queued commands can't follow in the same list either: killing the hidden window kills
+	# this process and the tmux client it is running.
+	try:
+		flush_cleanup_tmux_commands()
+	finally:
+		tmuxcmds = []
+		if swap_count % 2 == 1:
+			tmuxcmds.append(swap_hidden_pane_args())
+		tmuxcmds.append([ 'kill-window', '-t', args.hidden_window ])
+		runtmuxmulti(tmuxcmds)
+
+default_em_label_chars = 'asdghklqwertyuiopzxcvbnmfj;'
+
+def get_em_label_layout(n, nchars, min_nchars=1, max_nchars=None):
+	# Returns the number of chars to use for the labels of each length (starting at length 1) to label n
+	# locations using nchars available chars.  Each length uses a separate set of chars, so the labels are prefix-free.
+	# Determine how many chars per label are needed (integer math, since float logs are off by one at exact powers)
+	need_label_len = 1
+	while nchars ** need_label_len < n:
+		need_label_len += 1
+	if min_nchars > need_label_len:
+		need_label_len = min_nchars
+	if max_nchars and need_label_len > max_nchars:
+		need_label_len = max_nchars
+	# Determine how many letters are actually needed at such a length
+	at_len_need_chars = min(max(round(n ** (1 / need_label_len)), 1), nchars)
+	while at_len_need_chars < nchars and at_len_need_chars ** need_label_len < n:
+		at_len_need_chars += 1
+	while at_len_need_chars > 1 and (at_len_need_chars - 1) ** need_label_len >= n:
+		at_len_need_chars -= 1
+	# If there are free letters, then there are some available lower on the stack.  Evenly divide the
+	# remaininder among the lower tiers.
+	n_remaining_chars = nchars - at_len_need_chars
+	nchars_per_tier = [ at_len_need_chars ]
+	for i in range(need_label_len - 1):
+		nc = n_remaining_chars // (need_label_len - 1 - i)
+		if i+1 < min_nchars:
+			nc = 0
+		nchars_per_tier.append(nc)
+		n_remaining_chars -= nc
+	nchars_per_tier.reverse()
+	return nchars_per_tier
+
+# Label tables by (n, chars, min_nchars, max_nchars), so repeated batches and redraws don't rebuild them
+em_label_tables = {}
+
+def get_em_labels(n, chars=None, min_nchars=1, max_nchars=None):
+	"""Returns a tuple of easy-motion letter abbreviation sequences, shortest first, for n locations.
+
+	The tuple is cached and may be longer than n; use the first n labels.  No label is a prefix of another.
+	"""
+	all_chars = chars or default_em_label_chars
+	key = (n, all_chars, min_nchars, max_nchars)
+	if key in em_label_tables:
+		return em_label_tables[key]
+	# Construct the labels
+	labels = []
+	remaining_chars = all_chars
+	for tier, tier_nchars in enumerate(get_em_label_layout(n, len(all_chars), min_nchars, max_nchars)):
+		tierchars = remaining_chars[:tier_nchars]
+		remaining_chars = remaining_chars[tier_nchars:]
+		labels.extend(( ''.join(label) for label in itertools.product(tierchars, repeat=tier + 1) ))
+	labels = tuple(labels)
+	em_label_tables[key] = labels
+	return labels
+
+def gen_em_labels(n, chars=None, min_nchars=1, max_nchars=None):
+	# Generates easy-motion letter abbreviation sequences
+	return iter(get_em_labels(n, chars, min_nchars, max_nchars))
+
+def assign_em_labels(n, chars=None, reserved=()):
+	"""Returns a list of n labels that are prefix-free together with the reserved labels.
+
+	Reserved labels are ones already assigned to other locations that must stay the same.  Without any,
+	this is the first n labels of get_em_labels(n).
+	"""
+	if n == 0:
+		return []
+	reserved = set(reserved)
+	if len(reserved) == 0:
+		return list(get_em_labels(n, chars)[:n])
+	# Start with the layout the reserved labels most likely came from.  Since each table is prefix-free, if
+	# the reserved labels are all from it, the rest of it is free to use.
+	total = n + len(reserved)
+	table = get_em_labels(total, chars)
+	if reserved.issubset(table):
+		labels = [ label for label in table if label not in reserved ]
+		if len(labels) >= n:
+			return labels[:n]
+	# Otherwise labels that are reserved or are prefixes of reserved labels can't be used, nor can labels
+	# prefixed by one.  Grow the table until enough labels are free.
+	reserved_prefixes = { label[:i] for label in reserved for i in range(1, len(label) + 1) }
+	for attempt in range(8):
+		labels = [
+			label for label in get_em_labels(total, chars)
+			if label not in reserved_prefixes and not any(( label[:i] in reserved for i in range(1, len(label)) ))
+		]
+		if len(labels) >= n:
+			return labels[:n]
+		total *= 2
+	raise Exception('Not enough labels available')
+
+def strip_trailing_space(data):
+	"""Removes trailing whitespace from each line of pane capture data.
+
+	Arguments:
+		data -- String blob of data from `tmux capture-pane`, or its raw bytes (any bytes-like object, such
+			as a mapped capture file), which are decoded straight into the string without another copy
+
+	Returns:
+		The stripped data as a string.
+	"""
+	if not isinstance(data, str):
+		data = str(data, 'utf8')
+	return '\n'.join(( line.rstrip() for line in data.split('\n') ))
+
+def process_pane_capture_lines(data, nlines=None):
+	"""Given the string blob of data from `tmux capture-pane`, returns an array of line strings.
+
+	Arguments:
+		data -- String blob of data from `tmux capture-pane`
+		nlines -- Maximum number of lines to return
+
+	Returns:
+		An array of line strings.  Each line string corresponds to a single visible line such that
+		a wrapped line is returned as multiple visible lines.  Nonprintable characters are removed
+		and tabs are converted to spaces.
+	"""
+	# processes pane capture data into an array of lines
+	# also handles nonprintables
+	lines = [
+		''.join([
+			'        ' if c == '\t' else (
+				c if c.isprintable() else ''
+			)
+			for c in line
+		])
+		for line in data.split('\n')
+	]
+	if nlines != None:
+		lines = lines[:nlines]
+	return lines
+
+def process_pane_capture_line(line):
+	return ''.join([
+		'        ' if c == '\t' else (
+			c if c.isprintable() else ''
+		)
+		for c in line
+	])
+
+
+
+# Aligns display capture data to actual data that doesn't include wraps.
+# Returns a dict mapping each (x, y) in disp_data to an index in j_data.
+# If alignment fails, returns None.
+# size is x, y (column, lineno)
+def align_capture_data(disp_data, j_data, size):
+	# TODO: Add checks for if arguments are 0-length or otherwise invalid
+	jidx = 0
+	didx = 0
+	charmap = [] # map from index in disp_data to index in j_data
+	jcharmap = [] # map from index in j_data to index in disp_data
+	while didx < len(disp_data):
+		if jidx >= len(j_data):
+			charmap.append(len(j_data) - 1)
+			didx += 1
+			continue
+		jc = j_data[jidx]
+		dc = disp_data[didx]
+		if jc == dc: # usual case - characters match
+			charmap.append(jidx)
+			jcharmap.append(didx)
+			didx += 1
+			jidx += 1
+		elif dc == '\t' and jc == ' ':
+			for i in range(8):
+				if jidx < len(j_data) and j_data[jidx] == ' ':
+					jcharmap.append(didx)
+					jidx += 1
+				else:
+					break
+		elif jc == '\t' and dc == ' ':
+			for i in range(8):
+				if didx < len(disp_data) and disp_data[didx] == ' ':
+					charmap.append(jidx)
+					didx += 1
+				else:
+					break
+		elif dc == '\n' or dc == ' ' or dc == '\t':
+			charmap.append(max(jidx - 1, 0))
+			didx += 1
+		elif jc == ' ' or jc == '\t':
+			jcharmap.append(didx)
+			jidx += 1
+		else:
+			return None
+	# Pad maps to full length if necessary
+	while len(charmap) < len(disp_data):
+		charmap.append(len(j_data) - 1)
+	while len(jcharmap) < len(j_data):
+		jcharmap.append(len(disp_data) - 1)
+	# Convert character mapping to mapping indexed by disp_data (x, y)
+	xymap = {
+		xy : charmap[didx] if didx < len(charmap) and didx < len(disp_data) else len(j_data) - 1
+		for xy, didx in get_data_xy_idx_map(disp_data, size).items()
+	}
+	# Convert j character mapping to a mapping from j char index to display (x, y)
+	didx_rev_coord_map = get_data_xy_idx_rev_map(disp_data, size)
+	xymapj = [
+		didx_rev_coord_map[min(didx, len(disp_data) - 1)]
+		for didx in jcharmap
+	]
+	# Return values are:
+	# 0. Mapping dict from tuple (x, y) display position to index into j_data
+	# 1. Mapping list from index into j_data to (x, y) display position
+	# 2. Mapping list from index into disp_data to index into j_data
+	# 3. Mapping list from index into j_data to index into disp_data
+	return xymap, xymapj, charmap, jcharmap
+
+# Returns a mapping array from index in data (the pane capture data) to the (x, y) coordinates on screen
+def get_data_xy_idx_rev_map(data, size):
+	revmap = []
+	lines = data.split('\n')
+	lineno = 0
+	for i, line in enumerate(lines):
+		# Lines that fit on a row are mapped in bulk from the cell offsets of their chars
+		offsets, col = get_cell_offsets(line)
+		if col <= size[0] and '\t' not in line:
+			revmap.extend(zip(offsets, itertools.repeat(lineno)))
+		else:
+			col = 0
+			for dchar in line:
+				w = 1 if dchar < '\u0300' else char_width(dchar)
+				if w == 0 and col > 0:
+					# Combining chars share the cell of the char before them
+					revmap.append(revmap[-1])
+					continue
+				if col + w > size[0]:
+					lineno += 1
+					col = 0
+				revmap.append((col, lineno))
+				if dchar == '\t':
+					col = min(col + 8, size[0])
+				else:
+					col += w
+		if i < len(lines) - 1:
+			revmap.append((col, lineno))
+			lineno += 1
+	return revmap
+
+# Return a map from (x,y) to index into data
+def get_data_xy_idx_map(data, size):
+	xymap = {}
+	didx = 0
+	for lineno in range(size[1]):
+		nl = data.find('\n', didx)
+		end = len(data) if nl == -1 else nl
+		line = data[didx:end]
+		offsets, linewidth = get_cell_offsets(line)
+		if linewidth <= size[0]:
+			# The rest of the line fits on this row.  Cells after it map to its last char.
+			cells = [ max(end - 1, 0) ] * size[0]
+			if line.isascii():
+				cells[:len(line)] = range(didx, end)
+			else:
+				for i, c in enumerate(line):
+					w = char_width(c)
+					if w > 0:
+						cells[offsets[i]] = didx + i
+					if w == 2 and offsets[i] + 1 < size[0]:
+						cells[offsets[i] + 1] = didx + i
+			xymap.update(zip(zip(range(size[0]), itertools.repeat(lineno)), cells))
+			didx = end
+		else:
+			col = 0
+			while col < size[0]:
+				dc = data[didx]
+				w = 1 if dc < '\u0300' else char_width(dc)
+				if w == 0:
+					# Combining chars share the cell of the char before them
+					didx += 1
+					continue
+				if col + w > size[0]:
+					# A wide char that doesn't fit goes on the next row
+					xymap[(col, lineno)] = max(didx - 1, 0)
+					col += 1
+					continue
+				xymap[(col, lineno)] = didx
+				if w == 2:
+					col += 1
+					xymap[(col, lineno)] = didx
+				didx += 1
+				col += 1
+		if didx < len(data) and data[didx] == '\n':
+			didx += 1
+	return xymap
+
+
+def copy_backend_load_buffer(data):
+	runtmux([ 'load-buffer', '-' ], sendstdin=data)
+
+def copy_backend_set_buffer(data):
+	runtmux([ 'set-buffer', '--', escape_tmux_arg(data) ])
+
+def copy_backend_osc52(data):
+	# Write the OSC 52 clipboard sequence directly to the tty of the client attached to the target pane
+	client_tty = runtmux([ 'display-message', '-p', '-t', args.t, '#{client_tty}' ], one=True)
+	if not client_tty:
+		raise Exception('Could not find client tty for osc52 copy')
+	encoded = base64.b64encode(data.encode('utf8'))
+	with open(client_tty, 'wb') as f:
+		f.write(b'\x1b]52;c;' + encoded + b'\x07')
+
+copy_backends = {
+	'load-buffer': copy_backend_load_buffer,
+	'set-buffer': copy_backend_set_buffer,
+	'osc52': copy_backend_osc52
+}
+
+def get_copy_backend():
+	backend = get_tmux_option('@copytk-copy-backend', 'auto')
+	if backend == 'auto':
+		# Only fall back to running a shell command if a custom one is configured
+		command = get_tmux_option('@copytk-copy-command')
+		backend = 'command' if command and command != 'tmux load-buffer -' else 'load-buffer'
+	return backend
+
+def execute_copy(data):
+	start = time.perf_counter()
+	backend = get_copy_backend()
+	if backend == 'command':
+		command = get_tmux_option('@copytk-copy-command', 'tmux load-buffer -')
+		runshellcommand(os.path.expanduser(command), sendstdin=data)
+	elif backend in copy_backends:
+		copy_backends[backend](data)
+	else:
+		raise Exception(f'Invalid copy backend {backend}')
+	trace_add_span('copy', start, backend=backend)
+	log('Copied data.')
+
+# Tasks started by run_background(); these are waited on before the internal process exits
+background_tasks = []
+
+def run_background(fn, *fnargs):
+	# Runs fn in a thread.  Exceptions are saved and re-raised by wait_background_tasks().
+	task = { 'error': None }
+	def runtask():
+		try:
+			fn(*fnargs)
+		except Exception as ex:
+			task['error'] = ex
+	task['thread'] = threading.Thread(target=runtask, daemon=True)
+	task['thread'].start()
+	background_tasks.append(task)
+
+def wait_background_tasks():
+	while len(background_tasks) > 0:
+		task = background_tasks.pop(0)
+		task['thread'].join()
+		if task['error']:
+			raise task['error']
+
+def execute_copy_deferred(data):
+	# Copies data at cleanup time in the tmux invocation just before the original pane is swapped back,
+	# if the copy backend allows it.  Otherwise starts the copy in the background.
+	global cleanup_tmux_stdin, cleanup_copy_backend
+	backend = get_copy_backend()
+	trace_mark('copy_deferred', backend=backend)
+	if backend == 'load-buffer' and cleanup_tmux_stdin == None:
+		cleanup_tmux_commands.append([ 'load-buffer', '-' ])
+		cleanup_tmux_stdin = data
+		cleanup_copy_backend = backend
+	elif backend == 'set-buffer':
+		cleanup_tmux_commands.append([ 'set-buffer', '--', escape_tmux_arg(data) ])
+		cleanup_copy_backend = backend
+	else:
+		run_background(execute_copy, data)
+
+def show_copy_message(data):
+	# Shows a confirmation of the copy in the tmux status line once the original pane is restored.
+	# The message disappears on its own after the flash time.
+	delayt = float(get_tmux_option('@copytk-flash-time', '0.5'))
+	text = ' '.join(data.split())
+	if len(text) > 60:
+		text = text[:57] + '...'
+	message = escape_tmux_arg('Copied: ' + text.replace('#', '##'))
+	if tmux_version_at_least(args.tmux_version, 3, 2):
+		# A delay of 0 would keep the message up until a key is pressed
+		cleanup_tmux_commands.append([ 'display-message', '-d', max(int(delayt * 1000), 1), '-t', args.t, message ])
+	else:
+		# display-message has no -d before tmux 3.2, so the message stays up for the display-time option
+		cleanup_tmux_commands.append([ 'display-message', '-t', args.t, message ])
+
+#n = 10000
+#ls = gen_em_labels(n)
+#for i in range(n):
+#	print(next(ls))
+#exit(0)
+
+class ActionCanceled(Exception):
+	def __init__(self):
+		super().__init__('Action Canceled')
+
+def pane_state_key(pane):
+	return (pane['pane_size'], pane['cursor'], pane['scroll_position'], pane['mode'], pane['history_size'], pane['window_activity'])
+
+class PaneCapture:
+	"""Captured contents of the target pane along with the data derived from them.
+
+	A capture can be shared by several actions (in sticky mode) as long as the pane has not changed.
+	"""
+
+	def __init__(self, target, orig_pane=None, saved=None):
+		self.target = target
+		# Results computed by actions from this capture (such as quickcopy matches), for reuse by later actions
+		self.cache = {}
+		if saved != None:
+			self._load_saved(orig_pane, saved)
+		else:
+			self._capture(orig_pane)
+		if keep_run_data:
+			pane_captures.append(self)
+
+	def _capture(self, orig_pane):
+		# Fetch information about the pane and capture original contents, unless already provided
+		if orig_pane == None:
+			orig_pane = get_pane_info(self.target)
+		if 'contents' not in orig_pane:
+			mapped = str2bool(get_tmux_option('@copytk-capture-mmap', 'off'))
+			capture_pane_info_contents(orig_pane, capture=True, capturej=True, mapped=mapped)
+		self.orig_pane = orig_pane
+
+		# Sanitize the J capture data by removing trailing spaces on each line
+		if 'contentsj_mapped' in self.orig_pane:
+			self.copy_data = strip_trailing_space(self.orig_pane.pop('contentsj_mapped'))
+			# The stripped data is itself a valid -J capture, so it stands in for the raw one in recordings
+			self.orig_pane['contentsj'] = self.copy_data
+		else:
+			self.copy_data = strip_trailing_space(self.orig_pane['contentsj'])
+		log(self.copy_data, 'copy_data')
+
+		# Create a mapping from display coordinates to indexes into the copy data
+		with trace_span('align', size=list(self.orig_pane['pane_size'])):
+			aligninfo = align_capture_data(self.orig_pane['contents'], self.copy_data, self.orig_pane['pane_size'])
+		if aligninfo == None:
+			log('alignment failed')
+			# raise Exception('alignment failed')
+			# Fall back to just mapping the display data to itself.  Will break wrapped lines.
+			self.copy_data = self.orig_pane['contents']
+			self.disp_copy_map = get_data_xy_idx_map(self.copy_data, self.orig_pane['pane_size'])
+			self.copy_disp_map = get_data_xy_idx_rev_map(self.copy_data, self.orig_pane['pane_size'])
+		else:
+			self.disp_copy_map = aligninfo[0]
+			self.copy_disp_map = aligninfo[1]
+
+		# Set the contents to display
+		self.display_content_lines = process_pane_capture_lines(self.orig_pane['contents'], self.orig_pane['pane_size'][1])
+
+	def _load_saved(self, orig_pane, saved):
+		# Uses a capture saved by the precapture action, along with its alignment and quickcopy batches.
+		# The saved pane info is replaced by the current info, which must be in the same state.
+		self.orig_pane = dict(orig_pane, contents=saved['contents'], contentsj=saved['contentsj'])
+		self.copy_data = saved['copy_data']
+		self.disp_copy_map = saved['disp_copy_map']
+		self.copy_disp_map = saved['copy_disp_map']
+		self.display_content_lines = saved['display_content_lines']
+		for key, batches in saved['batches'].items():
+			self.cache[key] = LazyBatches(iter([
+				[ QuickCopyMatch(tier, start, end, self.copy_data, self.copy_disp_map) for tier, start, end in batch ]
+				for batch in batches
+			]))
+
+	def is_current(self):
+		# Checks whether the pane appears unchanged since the capture.  tmux has no cheap way to detect
+		# content changes, so this uses the cursor, scroll state, history size and window activity time.
+		return pane_state_key(get_pane_info(self.target)) == pane_state_key(self.orig_pane)
+
+
+class PaneJumpAction:
+
+	def __init__(self, stdscr, capture=None):
+		self.stdscr = stdscr
+		log('start run easymotion internal', time=True)
+
+		# Use the existing capture if given, otherwise capture the pane now
+		if capture == None:
+			capture = get_pane_capture(args.t)
+		self.capture = capture
+		self.orig_pane = capture.orig_pane
+		self.copy_data = capture.copy_data
+		self.disp_copy_map = capture.disp_copy_map
+		self.copy_disp_map = capture.copy_disp_map
+
+		# Fetch options
+		self.em_label_chars = get_tmux_option('@copytk-label-chars', default_em_label_chars)
+		self.has_capital_label_chars = bool(re.search(r'[A-Z]', self.em_label_chars))
+		self.cancel_keys = get_tmux_option_key_curses('@copytk-cancel-key', default='Escape Enter ^C', aslist=True)
+
+		# Initialize curses stuff.  The raw ANSI screen (copytk_ansi) sets up its own colors.
+		if hasattr(stdscr, 'init_pair'):
+			init_pair = stdscr.init_pair
+			color_pair = stdscr.color_pair
+		else:
+			curses.curs_set(False)
+			curses.start_color()
+			curses.use_default_colors()
+			init_pair = curses.init_pair
+			color_pair = curses.color_pair
+		def init_color(index, optname, default_fg, default_bg):
+			pair = get_tmux_option_color_pair_curses(optname, default_fg, default_bg)
+			init_pair(index, pair[0], pair[1])
+		init_color(1, '@copytk-color-labelchar', curses.COLOR_RED, -1) # first label char
+		init_color(2, '@copytk-color-labelchar2', curses.COLOR_YELLOW, -1) # second+ label char
+		init_color(3, '@copytk-color-highlight', curses.COLOR_GREEN, curses.COLOR_YELLOW) # highlight
+		init_color(4, '@copytk-color-message', curses.COLOR_RED, -1) # status message
+		self.color_attrs = [ color_pair(index) for index in range(5) ]
+		self.stdscr.clear()
+
+		# Track the size as known by curses
+		self.curses_size = stdscr.getmaxyx() # note: in (y,x) not (x,y)
+
+		# Set the contents to display
+		self.display_content_lines = capture.display_content_lines
+		self.last_key_time = None
+		self.drawn = False
+		self.labels_drawn = False
+		self.reset()
+		
+	def reset(self, keep_highlight=False):
+		# Initialize properties for later
+		self.cur_label_pos = 0 # how many label chars have been keyed in
+		self.match_locations = None # the currently valid search results [ (x, y, label) ]
+		self.status_msg = None # Message in bottom-right of screen
+
+		# Highlighted location
+		if not keep_highlight:
+			self.highlight_ranges = None # range is inclusive
+
+		# display current contents
+		log('\n'.join(self.display_content_lines), 'display_content_lines')
+		self.redraw()
+
+	def flash_highlight_range(self, hlrange, noredraw=False, preflash=False):
+		if not self.highlight_ranges:
+			self.highlight_ranges = []
+		if preflash:
+			delayt = float(get_tmux_option('@copytk-preflash-time', '0.05'))
+			self.redraw()
+			time.sleep(delayt)
+		if isinstance(hlrange, list):
+			self.highlight_ranges.extend(hlrange)
+		else:
+			self.highlight_ranges.append(hlrange)
+		self._redraw_highlight_ranges()
+		self.stdscr.refresh()
+		delayt = float(get_tmux_option('@copytk-flash-time', '0.5'))
+		time.sleep(delayt)
+		if isinstance(hlrange, list):
+			self.highlight_ranges = self.highlight_ranges[:-len(hlrange)]
+		else:
+			self.highlight_ranges.pop()
+		if not noredraw:
+			self._redraw_contents()
+			self.stdscr.refresh()
+
+	def copy_and_flash(self, data, hlrange, preflash=False):
+		# Copies data and shows confirmation.  In the default 'message' flash mode, the copy is deferred to
+		# the cleanup batch and confirmed with a self-expiring tmux message so the pane is released immediately.
+		flash_mode = get_tmux_option('@copytk-flash-mode', 'message')
+		if flash_mode == 'highlight':
+			run_background(execute_copy, data)
+			self.flash_highlight_range(hlrange, preflash=preflash)
+		else:
+			execute_copy_deferred(data)
+			if flash_mode != 'none':
+				show_copy_message(data)
+
+	def addstr(self, y, x, s, a=None):
+		if len(s) == 0: return
+		try:
+			if a == None:
+				self.stdscr.addstr(y, x, s)
+			else:
+				self.stdscr.addstr(y, x, s, a)
+		except Exception as err:
+			pass
+			# note: errors are expected in writes to bottom-right
+			#log(f'Error writing str to screen.  curses_size={self.curses_size} linelen={len(line)} i={i} err={str(err)}')
+
+	def _redraw_contents(self):
+		line_width = min(self.curses_size[1], self.orig_pane['pane_size'][0])
+		max_line = min(self.curses_size[0], len(self.display_content_lines))
+		for i in range(max_line):
+			line = self.display_content_lines[i][:line_width].ljust(self.curses_size[0])
+			self.addstr(i, 0, line)
+
+	def _redraw_highlight_ranges(self):
+		if not self.highlight_ranges: return
+		line_width = min(self.curses_size[1], self.orig_pane['pane_size'][0])
+		hlattr = self.color_attrs[3]
+		for rng in self.highlight_ranges:
+			for i in range(rng[0][1], rng[1][1] + 1):
+				line = self.display_content_lines[i]
+				if i < rng[0][1] or i > rng[1][1]: # whole line not hl
+					continue
+				elif i > rng[0][1] and i < rng[1][1]: # whole line hl
+					self.addstr(i, 0, cell_ljust(line, line_width), hlattr)
+				elif i == rng[0][1] and i == rng[1][1]: # range starts and stops on this line
+					self.addstr(i, rng[0][0], cell_slice(line, rng[0][0], rng[1][0]+1), hlattr)
+				elif i == rng[0][1]: # range starts on this line
+					self.addstr(i, rng[0][0], cell_slice(cell_ljust(line, line_width), rng[0][0]), hlattr)
+				elif i == rng[1][1]: # range ends on this line
+					self.addstr(i, 0, cell_slice(line, 0, rng[1][0]+1), hlattr)
+				else:
+					assert(False)
+
+	def _redraw_labels(self):
+		line_width = min(self.curses_size[1], self.orig_pane['pane_size'][0])
+		if self.match_locations:
+			for col, row, label in self.match_locations:
+				if col + len(label) > line_width:
+					label = label[:line_width - col]
+				if len(label) > self.cur_label_pos:
+					try:
+						self.stdscr.addstr(row, col, label[self.cur_label_pos], self.color_attrs[1])
+					except Exception as err:
+						pass
+						#log(f'Error writing str to screen.  curses_size={self.curses_size} linelen={len(line)} i={i} err={str(err)}')
+				if len(label) > self.cur_label_pos + 1:
+					try:
+						self.stdscr.addstr(row, col+1, label[self.cur_label_pos+1:], self.color_attrs[2])
+					except Exception as err:
+						pass
+						#log(f'Error writing str to screen.  curses_size={self.curses_size} linelen={len(line)} i={i} err={str(err)}')
+
+	def redraw(self):
+		self._redraw_contents()
+		self._redraw_labels()
+		# highlight ranges
+		self._redraw_highlight_ranges()
+		# status message
+		if self.status_msg:
+			try:
+				self.stdscr.addstr(self.curses_size[0] - 1, self.curses_size[1] - len(self.status_msg), self.status_msg, self.color_attrs[4])
+			except:
+				pass
+		# refresh
+		self.stdscr.refresh()
+		if not self.drawn:
+			self.drawn = True
+			trace_mark('first_draw')
+		if self.match_locations and not self.labels_drawn:
+			self.labels_drawn = True
+			trace_mark('first_label_draw')
+
+	def setstatus(self, msg):
+		self.status_msg = msg
+
+	def cancel(self):
+		raise ActionCanceled()
+
+	def getkey(self, valid=None):
+		if valid == None:
+			valid = lambda k: len(k) == 1 and k.isprintable()
+		# Key latency is the time from receiving the previous key until ready for the next one
+		if self.last_key_time != None:
+			trace_add_span('key_latency', self.last_key_time)
+		while True:
+			wait_start = time.perf_counter()
+			try:
+				key = self.stdscr.getkey()
+			except: # fix occasional weird curses bug where this behaves as non-blocking
+				key = 'none'
+			self.last_key_time = time.perf_counter()
+			trace_mark('key')
+			if keep_run_data:
+				recorded_keys.append((key, self.last_key_time - wait_start))
+			#if key in ('^[', '^C', '\n', '\x1b'):
+			if key in self.cancel_keys:
+				self.cancel()
+			if key == 'KEY_RESIZE':
+				self.curses_size = self.stdscr.getmaxyx()
+				self.redraw()
+				continue
+			if valid(key):
+				return key
+			#key = ' '.join([str(hex(ord(c))) for c in key])
+			#self.stdscr.addstr(0, 0, key)
+
+
+	def run(self):
+		pass
+
+
+class EasyMotionAction(PaneJumpAction):
+
+	def __init__(self, stdscr, search_len=1, search_direction=None, capture=None):
+		super().__init__(stdscr, capture)
+		self.search_len = search_len
+		self.search_direction = search_direction
+		self.case_sensitive_search = get_tmux_option('@copytk-case-sensitive-search', 'upper') # value values: on, off, upper
+		self.min_match_spacing = int(get_tmux_option('@copytk-min-match-spacing', '2'))
+		self.loc_label_mapping = {} # override mapping from match loc tuples to labels
+
+	def _em_filter_locs(self, locs):
+		d = self.search_direction
+		cursor = self.orig_pane['cursor']
+		if d == 'forward' or d == 'down':
+			return [
+				loc
+				for loc in locs
+				if loc[1] > cursor[1] or (loc[1] == cursor[1] and loc[0] >= cursor[0])
+			]
+		elif d == 'reverse' or d == 'up' or d == 'backward':
+			return [
+				loc
+				for loc in locs
+				if loc[1] < cursor[1] or (loc[1] == cursor[1] and loc[0] < cursor[0])
+			]
+		else:
+			return locs
+
+	def _em_sort_locs_cursor_proximity(self, locs, cursor=None):
+		# Sort locations by proximity to cursor
+		if cursor == None:
+			cursor = self.orig_pane['cursor']
+		locs.sort(key=lambda pos: abs(cursor[0] - pos[0]) + abs(cursor[1] - pos[1]) * self.orig_pane['pane_size'][0])
+
+	def _em_search_lines(self, datalines, srch, min_match_spacing=2, matchcase=False):
+		if not matchcase: srch = srch.lower()
+		results = [] # (x, y)
+		for linenum, line in reversed(list(enumerate(datalines))):
+			if not matchcase: line = line.lower()
+			# Locations are in screen cells, which differ from the index in the line after wide or combining chars
+			offsets = get_cell_offsets(line)[0]
+			pos = 0
+			while True:
+				r = line.find(srch, pos)
+				if r == -1: break
+				results.append((offsets[r], linenum))
+				pos = r + len(srch) + min_match_spacing
+		return results
+
+	def _em_input_search_chars(self):
+		search_str = ''
+		self.setstatus('INPUT CHAR')
+		self.redraw()
+		for i in range(self.search_len):
+			search_str += self.getkey()
+		self.setstatus(None)
+		self.redraw()
+		return search_str
+
+	def get_locations(self, action):
+		"""Returns a list of (x, y) locations of potential match locations.
+
+		Arguments:
+			action -- Either 'search' (to input a search char) or 'lines' (to use each line as a location)
+
+		Returns:
+			A list of (x, y) tuples where y is the line number and x is the character in the line.  The lines
+			represent "physical" lines (eg. a single wrapped line is treated as multiple physical lines here.)
+		"""
+		pane_search_lines = self.display_content_lines
+		log('\n'.join(pane_search_lines), 'pane_search_lines')
+
+		if action == 'search':
+			search_str = self._em_input_search_chars()
+			return self._em_search_lines(
+				pane_search_lines,
+				search_str,
+				self.min_match_spacing,
+				self.case_sensitive_search == 'on' or (self.case_sensitive_search == 'upper' and search_str.lower() != search_str)
+			)
+		elif action == 'lines':
+			return [ (0, y) for y in range(self.orig_pane['pane_size'][1]) ]
+		else:
+			raise Exception('Invalid copytk easymotion action')
+
+	def _input_easymotion_keys(self):
+		"""Waits for easymotion keypresses to select match; filters possible matches as is executed."""
+		# Wait for label presses
+		keyed_label = ''
+		while True: # loop over each key/char in the label
+			keyed_label += self.getkey()
+			self.cur_label_pos += 1
+			self.match_locations = [ m for m in self.match_locations if m[2].startswith(keyed_label) ]
+			if len(self.match_locations) < 2:
+				break
+			self.redraw()
+		log('keyed label: ' + keyed_label, time=True)
+
+
+	def do_easymotion(self, action, filter_locs=None, sort_close_to=None, save_labels=False):
+		# Get possible jump locations sorted by proximity to cursor
+		locs = self.get_locations(action)
+		locs = self._em_filter_locs(locs)
+		if filter_locs:
+			locs = [ l for l in locs if filter_locs(l) ]
+		if len(locs) == 0:
+			raise ActionCanceled()
+		self._em_sort_locs_cursor_proximity(locs, sort_close_to)
+		trace_mark('locations', count=len(locs))
+
+		# Assign each match a label, keeping any labels saved from earlier batches
+		new_locs = [ ml for ml in locs if ml not in self.loc_label_mapping ]
+		new_labels = dict(zip(new_locs, assign_em_labels(len(new_locs), self.em_label_chars, self.loc_label_mapping.values())))
+		self.match_locations = [ ( ml[0], ml[1], self.loc_label_mapping.get(ml) or new_labels[ml] ) for ml in locs ]
+
+		# If save_labels is true, preserve labels for locations across batches
+		if save_labels:
+			self.loc_label_mapping.update(new_labels)
+
+		# Draw labels
+		self.redraw()
+
+		# Wait for keypresses
+		self._input_easymotion_keys()
+
+		if len(self.match_locations) == 0:
+			return None
+		else:
+			return (self.match_locations[0][0], self.match_locations[0][1])
+
+	def run(self, action):
+		log('easymotion swapping in hidden pane', time=True)
+		swap_hidden_pane(True)
+
+		loc = self.do_easymotion(action)
+		
+		# If a location was found, move cursor there in original pane
+		if loc:
+			log('match location: ' + str(loc), time=True)
+			# Locations are screen cells, but copy mode moves the cursor by chars
+			x = cell_char_count(self.display_content_lines[loc[1]], loc[0]) if loc[1] < len(self.display_content_lines) else loc[0]
+			move_tmux_cursor((x, loc[1]), self.orig_pane['pane_id'], scroll_position=self.orig_pane['scroll_position'], pane_height=self.orig_pane['pane_size'][1])
+
+
+class EasyCopyAction(EasyMotionAction):
+
+	def __init__(self, stdscr, search_len=1, search_direction=None, capture=None):
+		super().__init__(stdscr, search_len, search_direction, capture)
+
+	def run(self):
+		log('easycopy swapping in hidden pane', time=True)
+		swap_hidden_pane(True)
+
+		# Input searches to get bounds
+		pos1 = self.do_easymotion('search')
+		if not pos1: return
+		self.highlight_ranges = [ (pos1, pos1) ]
+		self.reset(keep_highlight=True)
+		# restrict second search to after first position
+		pos2 = self.do_easymotion(
+			'search',
+			filter_locs=lambda loc: loc[1] > pos1[1] or (loc[1] == pos1[1] and loc[0] > pos1[0]),
+			sort_close_to=pos1
+		)
+		if not pos2: return
+
+		# since typing last n letters of word, advance end position by n-1 (-1 because range is inclusive)
+		pos2 = (pos2[0] + self.search_len - 1, pos2[1])
+
+		# Find the data associated with this range and run the copy command
+		selected_data = self.copy_data[self.disp_copy_map[pos1] : self.disp_copy_map[pos2] + 1]
+		log('Copied: ' + selected_data)
+		self.copy_and_flash(selected_data, (pos1, pos2))
+
+
+class LineCopyAction(EasyMotionAction):
+
+	def __init__(self, stdscr, search_direction=None, capture=None):
+		super().__init__(stdscr, search_direction=search_direction, capture=capture)
+
+	# override from EasyMotionAction to support single-char line selection
+	def _input_easymotion_keys(self):
+		"""Waits for easymotion keypresses to select match; filters possible matches as is executed."""
+		keyed_label = ''
+		while True: # loop over each key/char in the label
+			k = self.getkey()
+			if not self.has_capital_label_chars and re.fullmatch('[A-Z]', k) and self.easymotion_phase == 0:
+				# Enable single-line-copy mode
+				k = k.lower()
+				self.single_line_copy = True
+			keyed_label += k
+			self.cur_label_pos += 1
+			self.match_locations = [ m for m in self.match_locations if m[2].startswith(keyed_label) ]
+			if len(self.match_locations) < 2:
+				break
+			self.redraw()
+		log('keyed label: ' + keyed_label, time=True)
+
+	def run(self):
+		log('easycopy linecopy swapping in hidden pane', time=True)
+		swap_hidden_pane(True)
+
+		# Input searches to get bounds
+		self.easymotion_phase = 0
+		self.single_line_copy = False
+		pos1 = self.do_easymotion('lines', save_labels=True)
+		if not pos1: return
+
+		if self.single_line_copy:
+			# Copy single logical line starting at pos1.
+			# Find end of line as a copy data index
+			startidx = self.disp_copy_map[pos1]
+			endidx = self.copy_data.find('\n', startidx)
+			if endidx == -1:
+				endidx = len(self.copy_data)
+				pos2 = self.copy_disp_map[len(self.copy_data) - 1]
+				selected_data = self.copy_data[startidx:]
+			else:
+				pos2 = self.copy_disp_map[endidx-1]
+				selected_data = self.copy_data[startidx:endidx]
+		else:
+			self.highlight_ranges = [ (pos1, pos1) ]
+			self.reset(keep_highlight=True)
+			# restrict second search to after first position
+			self.easymotion_phase = 1
+			pos2 = self.do_easymotion(
+				'lines',
+				filter_locs=lambda loc: loc[1] > pos1[1] or (loc[1] == pos1[1] and loc[0] >= pos1[0]),
+				sort_close_to=pos1
+			)
+			if not pos2: return
+
+			# since typing last n letters of word, advance end position by n-1 (-1 because range is inclusive)
+			pos2 = (self.orig_pane['pane_size'][0] - 1, pos2[1])
+
+			# Find the data associated with this range and run the copy command
+			selected_data = self.copy_data[self.disp_copy_map[pos1] : self.disp_copy_map[pos2] + 1]
+
+		log('Copied: ' + selected_data)
+		self.copy_and_flash(selected_data, (pos1, pos2))
+
+
+class QuickCopyMatch:
+	"""A quickcopy match of copy_data[start:end].  The text and display positions are only looked up when used,
+	since most matches are never displayed."""
+
+	__slots__ = ('tier', 'start', 'end', 'copy_data', 'copy_disp_map')
+
+	def __init__(self, tier, start, end, copy_data, copy_disp_map):
+		self.tier = tier
+		self.start = start
+		self.end = end
+		self.copy_data = copy_data
+		self.copy_disp_map = copy_disp_map
+
+	@property
+	def length(self):
+		return self.end - self.start
+
+	@property
+	def text(self):
+		return self.copy_data[self.start:self.end]
+
+	@property
+	def disp_start(self): # (x, y)
+		return self.copy_disp_map[self.start] if self.start < len(self.copy_data) else len(self.copy_data) - 1
+
+	@property
+	def disp_end(self): # (x, y)
+		return self.copy_disp_map[self.end - 1]
+
+	def __repr__(self):
+		return f'QuickCopyMatch({self.tier}, {self.start}, {self.end}, {self.text!r})'
+
+
+class LazyBatches:
+	"""Iterable over match batches that are generated as needed and kept, so they can be iterated more than once."""
+
+	def __init__(self, batch_it):
+		self.batches = []
+		self.batch_it = batch_it
+
+	def __iter__(self):
+		i = 0
+		while True:
+			if i == len(self.batches):
+				batch = next(self.batch_it, None)
+				if batch == None: return
+				self.batches.append(batch)
+			yield self.batches[i]
+			i += 1
+
+
+def get_tier_exprs_option(prefix='@copytk-quickcopy-'):
+	# Load in the tiers of match expressions.
+	# Options for this are in the form: @copytk-quickcopy-match-<Tier>-<TierIndex>
+	# Each tier list is terminated by a missing option at the index.
+	# The set of tiers is terminated by a missing 0 index for the tier.
+	tier_exprs = [] # list (of tiers) of lists of strings
+	tier_ctr = 0
+	while True:
+		l = get_tmux_option(prefix + 'match-' + str(tier_ctr), aslist=True, userlist=True)
+		if l == None or len(l) == 0:
+			break
+		tier_exprs.append(l)
+		tier_ctr += 1
+	return tier_exprs
+
+
+class QuickCopyAction(PaneJumpAction):
+
+	def __init__(self, stdscr, options_prefix='@copytk-quickcopy-', capture=None):
+		super().__init__(stdscr, capture)
+		self.options_prefix = options_prefix
+		self._load_options(options_prefix)
+		self.em_label_chars = ''.join(( c for c in self.em_label_chars if c not in self.next_batch_char ))
+
+	def _load_options(self, prefix='@copytk-quickcopy-'):
+		self.tier_exprs = get_tier_exprs_option(prefix)
+		self.next_batch_char = get_tmux_option_key_curses(prefix + 'next-batch-char', ' n', aslist=True)
+		self.min_match_len = int(get_tmux_option(prefix + 'min-match-len', 4))
+		self.pack_tiers = str2bool(get_tmux_option(prefix + 'pack-tiers', 'on'))
+		self.multi_separator = get_tmux_option(prefix + 'multi-separator', '\n')
+		self.line_memo = get_tmux_option(prefix + 'line-memo', 'auto')
+
+	def _matchobjs(self, tuplist, tier=0):
+		# Matches shorter than the minimum are dropped before creating match objects for them
+		min_len = self.min_match_len
+		copy_data = self.copy_data
+		copy_disp_map = self.copy_disp_map
+		return [ QuickCopyMatch(tier, start, end, copy_data, copy_disp_map) for start, end in tuplist if end - start >= min_len ]
+
+	def _find_lines_matches(self):
+		start = 0
+		for i, c in enumerate(self.copy_data):
+			if c == '\n':
+				if i > start:
+					yield (start, i)
+				start = i + 1
+		if len(self.copy_data) > start + 1:
+			yield (start, len(self.copy_data))
+
+	def use_line_memo(self, expr, flags):
+		# Matching per line pays off when many lines repeat, like log output, and is only exact for line-local exprs
+		if self.line_memo == 'off' or not expr_is_line_local(expr, flags):
+			return False
+		if getattr(self, 'copy_lines', None) == None:
+			self.copy_lines = self.copy_data.split('\n')
+			self.copy_lines_distinct = len(set(self.copy_lines))
+		return self.line_memo == 'on' or self.copy_lines_distinct <= len(self.copy_lines) * line_memo_max_distinct
+
+	# Returns an iterator over (start, end) tuples
+	def find_expr_matches(self, expr):
+		if expr in preset_scanners:
+			# Same matches as the preset's regex, without its worst-case backtracking
+			log('Matching against preset scanner ' + expr)
+			for d in preset_scanners[expr](self.copy_data):
+				if logdir:
+					log('Found match: ' + str(d) + ': ' + self.copy_data[d[0]:d[1]])
+				yield d
+			return
+		if expr in match_expr_presets:
+			expr = match_expr_presets[expr]
+		if expr == 'lines':
+			for m in self._find_lines_matches():
+				yield m
+			return
+		# regex expr
+		log('Matching against expr ' + expr)
+		flags = 0
+		if expr.startswith('(?m)'):
+			flags = re.MULTILINE
+			expr = expr[4:]
+		if self.use_line_memo(expr, flags):
+			log('Matching once per distinct line')
+			spans = find_line_memo_matches(expr, flags, self.copy_lines)
+		else:
+			spans = ( match_span(m) for m in re.finditer(expr, self.copy_data, flags) )
+		for d in spans:
+			if logdir:
+				log('Found match: ' + str(d) + ': ' + self.copy_data[d[0]:d[1]])
+			if d[0] < 0 or d[1] < 0:
+				d = ( 0, 0 )
+			yield d
+
+	def iter_tier_matches(self):
+		# Yields a list of the QuickCopyMatch objects for each tier in turn, matching the tier's expressions when it is asked for
+		for tier, exprs in enumerate(self.tier_exprs):
+			tiermatches = []
+			for expr in exprs:
+				with trace_span('match_expr', tier=tier, expr=expr[:80]):
+					tiermatches.extend(self._matchobjs(self.find_expr_matches(expr), tier))
+			yield tiermatches
+
+	def find_matches(self):
+		# Produce a list of QuickCopyMatch objects for matches at least the minimum length
+		return list(itertools.chain.from_iterable(self.iter_tier_matches()))
+
+	def iter_match_batches(self, matches, pack_tiers=True):
+		# Arrange the set of matches into batches of non-overlapping ones, by tier, and by shortness (shorter preferred)
+		# Do this by "writing" each match's range onto a virtual screen, marking each char, and pushing overlapping ones
+		# to the next batch.  Batches are generated as needed, since usually only the first is shown.
+		# matches is either a list of matches or an iterator over the list of matches of each tier in order (as from
+		# iter_tier_matches()).  Tiers are only taken from an iterator when they could add to the batch being arranged,
+		# so lower tiers may never need to be matched.
+		if isinstance(matches, list):
+			tiers = {}
+			for m in matches:
+				tiers.setdefault(m.tier, []).append(m)
+			matches = iter([ tiers[tier] for tier in sorted(tiers) ])
+		tier_it = matches
+		# Dedup matches, keeping the one in the lowest tier
+		c_match_set = set()
+		def next_tier():
+			# Order the tier by length and position (integer keys only; no text comparisons), minus duplicates
+			tiermatches = next(tier_it, None)
+			if tiermatches == None: return None
+			tiermatches.sort(key=lambda m: (m.end - m.start, m.start))
+			ordered = []
+			for m in tiermatches:
+				if (m.start, m.end) not in c_match_set:
+					c_match_set.add((m.start, m.end))
+					ordered.append(m)
+			return ordered
+		# A match can only be added to a batch if it fits in a gap at least this long
+		min_gap = bytes(max(self.min_match_len, 0))
+		tiers_left = True
+		matches = [] # remaining matches from the tiers taken so far, in order
+		# Segment into batches by overlap
+		log('start arrange_matches')
+		while True: # iterate over batches
+			last_added_tier = None
+			overlaps = []
+			virt = bytearray(len(self.copy_data))
+			batch = []
+			i = 0
+			while True: # iterate over remaining matches
+				if i == len(matches):
+					# Take the next tier unless none of its matches could be added to this batch: when tiers aren't
+					# packed, once the batch has matches, and otherwise once there are no gaps left that are long enough
+					if not tiers_left: break
+					if not pack_tiers and last_added_tier != None: break
+					if pack_tiers and virt.find(min_gap) == -1: break
+					tiermatches = next_tier()
+					if tiermatches == None:
+						tiers_left = False
+						break
+					matches.extend(tiermatches)
+					continue
+				m = matches[i]
+				if not pack_tiers and last_added_tier != None and m.tier != last_added_tier:
+					overlaps.extend(matches[i:])
+					break
+				# Check if overlaps
+				if virt.find(1, m.start, m.end) != -1:
+					overlaps.append(m)
+				else:
+					batch.append(m)
+					virt[m.start:m.end] = b'\x01' * (m.end - m.start)
+					last_added_tier = m.tier
+				i += 1
+			if len(batch) == 0: return
+			yield batch
+			matches = overlaps
+
+	def arrange_matches(self, matches, pack_tiers=True):
+		return list(self.iter_match_batches(matches, pack_tiers))
+
+	def run_batch(self, batch):
+		# Returns a match object if one is selected. (actually a list of match objects that will all have same text)
+		# Returns None to cycle to next batch
+		# Throws ActionCanceled if canceled or invalid selection
+		# Sets self.multi_mark if the label was keyed in uppercase to mark the selection and keep going
+		self.multi_mark = False
+		
+		# Assign a code to each match in the batch
+		labels = []
+		match_text_label_map = {} # use this so matches with same text have same label
+		label_table = get_em_labels(len(batch), self.em_label_chars)
+		for match in batch:
+			if match.text not in match_text_label_map:
+				match_text_label_map[match.text] = label_table[len(match_text_label_map)]
+			labels.append(match_text_label_map[match.text])
+		
+		# Set up match_locations and highlights
+		self.match_locations = [ ( match.disp_start[0], match.disp_start[1], labels[i] ) for i, match in enumerate(batch) ]
+		line_width = self.orig_pane['pane_size'][0]
+		def updatehl():
+			self.highlight_ranges = [
+				(
+					( min(match.disp_start[0] + len(labels[i]) - self.cur_label_pos, line_width), match.disp_start[1] ),
+					match.disp_end
+				)
+				for i, match in enumerate(batch) 
+			]
+		updatehl()
+		self.redraw()
+
+		# Input label
+		keyed_label = ''
+		while True: # loop over each key/char in the label
+			k = self.getkey() # checks for cancel key and throws
+			if k in self.next_batch_char:
+				return None
+			if not self.has_capital_label_chars and re.fullmatch('[A-Z]', k):
+				k = k.lower()
+				self.multi_mark = True
+			keyed_label += k
+			self.cur_label_pos += 1
+			# Update match locations and highlights
+			new_match_locations = []
+			new_labels = []
+			new_batch = []
+			for i, label in enumerate(labels):
+				if label.startswith(keyed_label):
+					new_labels.append(label)
+					new_match_locations.append(self.match_locations[i])
+					new_batch.append(batch[i])
+			batch = new_batch
+			labels = new_labels
+			self.match_locations = new_match_locations
+			updatehl()
+			self.match_locations = [ m for m in self.match_locations if m[2].startswith(keyed_label) ]
+			# count remaining matches by ones with unique text rather than total count
+			num_unique_texts = len(set(( m.text for m in batch )))
+			if num_unique_texts < 2:
+				break
+			self.redraw()
+		log('keyed label: ' + keyed_label, time=True)
+
+		self.reset()
+		if len(batch) == 0:
+			raise ActionCanceled() # invalid entry
+		else:
+			return batch
+
+	def get_match_batches(self):
+		# Matches depend only on the capture and the match options, so reuse them if already computed from this capture
+		cache_key = ('quickcopy-batches', tuple(( tuple(exprs) for exprs in self.tier_exprs )), self.min_match_len, self.pack_tiers)
+		batches = self.capture.cache.get(cache_key)
+		if batches == None:
+			# Group the matches into display batches.  Tiers are matched as they're needed by the batches, so the
+			# lowest tiers often don't need to be matched for the first batch.
+			found = []
+			def tier_matches():
+				for tiermatches in self.iter_tier_matches():
+					found.append(len(tiermatches))
+					yield tiermatches
+			batches = LazyBatches(self.iter_match_batches(tier_matches(), self.pack_tiers))
+			# Only the first batch is arranged now; the rest are arranged if cycled to.  The span includes matching
+			# the tiers the first batch needs.
+			with trace_span('arrange_matches') as span:
+				next(iter(batches), None)
+				span.targs['matches'] = sum(found)
+				span.targs['tiers'] = len(found)
+			log('arranged matches')
+			self.capture.cache[cache_key] = batches
+		return batches
+
+	def run_quickselect(self):
+		# Returns a list of selections, each of which is a list of match objects with the same text.
+		# More than one selection is returned if labels were keyed in uppercase to mark multiple matches.
+		log('quickcopy run')
+		batches = self.get_match_batches()
+		if next(iter(batches), None) == None: raise ActionCanceled()
+
+		swap_hidden_pane(True)
+		log('swapped in hidden pane')
+
+		selections = []
+		selected_texts = set()
+		while True:
+			# Display each batch until a valid match has been selected.  Already-marked matches are not shown again.
+			selected = None
+			for batch in batches:
+				batch = [ m for m in batch if m.text not in selected_texts ]
+				if len(batch) == 0: continue
+				if len(selections) > 0:
+					self.setstatus(f'{len(selections)} SELECTED')
+				selected = self.run_batch(batch)
+				if selected: break
+			if not selected:
+				# Cycling past the last batch, or marking every match, ends the selection with what was marked
+				if len(selections) == 0: raise ActionCanceled()
+				break
+			selections.append(selected)
+			selected_texts.add(selected[0].text)
+			if not self.multi_mark: break
+
+		# Got result.
+		log('Selected: ' + str([ sel[0].text for sel in selections ]))
+		return selections
+
+	def run(self):
+		selections = self.run_quickselect()
+		selected_data = self.multi_separator.join(( sel[0].text for sel in selections ))
+
+		# Flash highlights
+		self.match_locations = None
+		flash_only_one = str2bool(get_tmux_option('@copytk-flash-only-one', 'on'))
+		hl_ranges = []
+		for selected in selections:
+			sel_ranges = [ (match.disp_start, match.disp_end) for match in selected ]
+			if flash_only_one: sel_ranges = [ sel_ranges[-1] ]
+			hl_ranges.extend(sel_ranges)
+		self.copy_and_flash(selected_data, hl_ranges, preflash=True)
+
+
+# Parsed env files, keyed by path.  Each entry is (mtime, env dict).
+env_file_cache = {}
+
+def load_env_file(fn):
+	try:
+		mtime = os.stat(fn).st_mtime
+	except FileNotFoundError:
+		return {}
+	if fn in env_file_cache and env_file_cache[fn][0] == mtime:
+		return env_file_cache[fn][1]
+	ret = {}
+	with open(fn, 'r') as f:
+		for line in f:
+			line = line.strip()
+			if not len(line): continue
+			if line[0] == '#': continue
+			parts = line.split('=')
+			if len(parts) < 2: continue
+			name = parts[0]
+			value = '='.join(parts[1:])
+			if len(value) >= 2 and value[0] in ('"', "'") and value[-1] in ('"', "'"):
+				value = value[1:-1]
+			ret[name] = value
+	log('Loaded env file: ' + str(ret))
+	env_file_cache[fn] = (mtime, ret)
+	return ret
+
+class QuickOpenAction(QuickCopyAction):
+	
+	def __init__(self, stdscr, capture=None):
+		super().__init__(stdscr, options_prefix='@copytk-quickopen-', capture=capture)
+		self.command_extra_env = self.load_env_file()
+
+	def load_env_file(self):
+		return load_env_file(os.path.expanduser(get_tmux_option('@copytk-quickopen-env-file', '~/.tmux-copytk-env')))
+
+	def run(self):
+		selections = self.run_quickselect()
+		selected_items = [ sel[0].text for sel in selections ]
+		log('quickopen selected: ' + str(selected_items))
+
+		default_open_cmd = 'xdg-open'
+		if platform.system() == 'Darwin':
+			default_open_cmd = 'open'
+		open_cmd = shlex.split(get_tmux_option('@copytk-quickopen-open-command', default_open_cmd))
+		open_cmd[0] = os.path.expanduser(open_cmd[0])
+		env = dict(os.environ)
+		env.update(self.command_extra_env)
+		log('Env: ' + str(env))
+		# Either pass all selections to one invocation of the open command, or run it once per selection
+		if str2bool(get_tmux_option('@copytk-quickopen-multi-args', 'off')):
+			argvs = [ open_cmd + selected_items ]
+		else:
+			argvs = [ open_cmd + [ item ] for item in selected_items ]
+		for argv in argvs:
+			log('Command: ' + str(argv))
+			# Detach the opener from this process so it outlives the hidden pane
+			subprocess.Popen(
+				argv,
+				stdin=subprocess.DEVNULL,
+				stdout=subprocess.DEVNULL,
+				stderr=subprocess.DEVNULL,
+				env=env,
+				close_fds=True,
+				start_new_session=True
+			)
+
+
+def run_easymotion(stdscr, capture=None):
+	nkeys = 1
+	if args.search_nkeys:
+		nkeys = int(args.search_nkeys)
+	action = args.action[11:]
+	EasyMotionAction(stdscr, nkeys, args.search_direction, capture).run(action)
+
+def run_easycopy(stdscr, capture=None):
+	nkeys = 1
+	if args.search_nkeys:
+		nkeys = int(args.search_nkeys)
+	EasyCopyAction(stdscr, nkeys, args.search_direction, capture).run()
+
+def run_linecopy(stdscr, capture=None):
+	LineCopyAction(stdscr, args.search_direction, capture).run()
+
+def run_quickcopy(stdscr, capture=None):
+	QuickCopyAction(stdscr, capture=capture).run()
+
+def run_quickopen(stdscr, capture=None):
+	QuickOpenAction(stdscr, capture=capture).run()
+
+def get_action_runner(action):
+	if action.startswith('easymotion-'):
+		return run_easymotion
+	return {
+		'easycopy': run_easycopy,
+		'linecopy': run_linecopy,
+		'quickcopy': run_quickcopy,
+		'quickopen': run_quickopen
+	}.get(action)
+
+# Keys available in the sticky mode prompt, mapped to functions that run the action on a capture
+sticky_actions = {
+	's': lambda stdscr, capture: EasyMotionAction(stdscr, 1, capture=capture).run('search'),
+	'S': lambda stdscr, capture: EasyMotionAction(stdscr, 2, capture=capture).run('search'),
+	'j': lambda stdscr, capture: EasyMotionAction(stdscr, search_direction='forward', capture=capture).run('lines'),
+	'k': lambda stdscr, capture: EasyMotionAction(stdscr, search_direction='backward', capture=capture).run('lines'),
+	'n': lambda stdscr, capture: EasyMotionAction(stdscr, capture=capture).run('lines'),
+	'y': lambda stdscr, capture: EasyCopyAction(stdscr, 1, capture=capture).run(),
+	'Y': lambda stdscr, capture: EasyCopyAction(stdscr, 2, capture=capture).run(),
+	'w': lambda stdscr, capture: LineCopyAction(stdscr, capture=capture).run(),
+	'q': lambda stdscr, capture: QuickCopyAction(stdscr, capture=capture).run(),
+	'p': lambda stdscr, capture: QuickOpenAction(stdscr, capture=capture).run()
+}
+
+class StickyPromptAction(PaneJumpAction):
+	"""Displays the captured pane and waits for the key of the next action to run in sticky mode."""
+
+	def run(self):
+		self.setstatus('COPYTK')
+		self.redraw()
+		return self.getkey(lambda k: k in sticky_actions)
+
+def run_sticky(stdscr):
+	# Keep the overlay swapped in and run actions one after another, reusing the capture while the pane is unchanged.
+	# The session ends when a cancel key is pressed at the prompt.
+	swap_hidden_pane(True)
+	capture = None
+	first_action = get_action_runner(args.action)
+	while True:
+		if capture == None or not capture.is_current():
+			log('sticky capturing pane', time=True)
+			capture = get_pane_capture(args.t)
+		if first_action != None:
+			run_action = first_action
+		else:
+			key = StickyPromptAction(stdscr, capture).run()
+			run_action = sticky_actions[key]
+		try:
+			run_action(stdscr, capture)
+		except ActionCanceled:
+			pass
+		first_action = None
+		# Run deferred copies and messages now rather than at exit
+		flush_cleanup_tmux_commands()
+		wait_background_tasks()
+
+def make_headless_quickcopy(capture, options_prefix='@copytk-quickcopy-'):
+	# Builds a QuickCopyAction that can find and arrange matches without curses, for use outside the overlay
+	qc = QuickCopyAction.__new__(QuickCopyAction)
+	qc.capture = capture
+	qc.copy_data = capture.copy_data
+	qc.copy_disp_map = capture.copy_disp_map
+	qc._load_options(options_prefix)
+	return qc
+
+def iter_text_chunks(source, chunk_size=1 << 20):
+	# Splits a string or text file into chunks of about chunk_size chars made of whole lines.  Yields
+	# (offset, chunk) without the newline at the end of each chunk.
+	if isinstance(source, str):
+		if len(source) <= chunk_size:
+			yield 0, source
+			return
+		source = io.StringIO(source)
+	offset = 0
+	rest = ''
+	while True:
+		block = source.read(chunk_size)
+		if not block:
+			break
+		data = rest + block
+		nl = data.rfind('\n')
+		if nl == -1:
+			rest = data
+			continue
+		yield offset, data[:nl]
+		offset += nl + 1
+		rest = data[nl + 1:]
+	if rest or offset == 0:
+		yield offset, rest
+
+def find_text_matches(source, tier_exprs=None, min_match_len=4, chunk_size=1 << 20):
+	"""Finds quickcopy matches in text without tmux or curses.  source is a string or a text file, which is read
+	in chunks of whole lines as matches are found, so matches don't span chunks.  tier_exprs is a list of tiers of
+	regexes or preset names, defaulting to the default quickcopy tiers.  Yields a dict for each match with its tier,
+	start and end offsets in the text, text, and line and column (from 1) of its start, in order of tier and then
+	expression within each chunk.  A span matched by more than one expression is only given for the first."""
+	if tier_exprs == None:
+		tier_exprs = default_tier_exprs
+	qc = QuickCopyAction.__new__(QuickCopyAction)
+	qc.tier_exprs = tier_exprs
+	qc.min_match_len = min_match_len
+	qc.line_memo = 'auto'
+	qc.copy_disp_map = None
+	line = 1
+	for offset, chunk in iter_text_chunks(source, chunk_size):
+		qc.copy_data = chunk
+		qc.copy_lines = None
+		line_starts = [ 0 ]
+		nl = chunk.find('\n')
+		while nl != -1:
+			line_starts.append(nl + 1)
+			nl = chunk.find('\n', nl + 1)
+		seen = set()
+		for tiermatches in qc.iter_tier_matches():
+			for m in tiermatches:
+				if ( m.start, m.end ) in seen: continue
+				seen.add(( m.start, m.end ))
+				i = bisect.bisect_right(line_starts, m.start) - 1
+				yield {
+					'tier': m.tier,
+					'start': offset + m.start,
+					'end': offset + m.end,
+					'text': m.text,
+					'line': line + i,
+					'col': m.start - line_starts[i] + 1
+				}
+		line += len(line_starts)
+
+# Saved captures older than this are removed by the precapture action
+precapture_max_age = 3600
+# Changed whenever the contents of saved captures change
+precapture_version = 1
+
+def get_precapture_dir():
+	# Saved captures hold pane contents and are loaded with marshal, so they are kept in a directory that only this
+	# user can access (in tmpfs if available).  Returns None if the directory isn't private.
+	import tempfile
+	base = '/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir()
+	path = os.path.join(base, f'copytk-{os.getuid()}')
+	try:
+		os.makedirs(path, mode=0o700, exist_ok=True)
+		st = os.lstat(path)
+	except OSError:
+		return None
+	if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+		log('precapture directory is not private: ' + path)
+		return None
+	return path
+
+def get_precapture_path(pane):
+	precapture_dir = get_precapture_dir()
+	if precapture_dir == None: return None
+	# Pane ids are only unique within a tmux server
+	return os.path.join(precapture_dir, f'{pane["server_pid"]}-{pane["pane_id"].lstrip("%")}.marshal')
+
+def read_precapture(path):
+	try:
+		with open(path, 'rb') as f:
+			saved = marshal.load(f)
+	except (OSError, EOFError, ValueError, TypeError):
+		return None
+	if not isinstance(saved, dict) or saved.get('version') != precapture_version:
+		return None
+	return saved
+
+def precapture_is_current(saved, pane):
+	# Uses the same checks as PaneCapture.is_current().  tmux only records the window activity time to the
+	# second, so the window must also have been inactive since before the second the capture started.
+	try:
+		activity = int(pane['window_activity'])
+	except ValueError:
+		return False
+	return pane_state_key(pane) == pane_state_key(saved['orig_pane']) and activity < int(saved['time'])
+
+def save_precapture(capture, capture_time, path):
+	saved = {
+		'version': precapture_version,
+		'time': capture_time,
+		'orig_pane': { key : value for key, value in capture.orig_pane.items() if key not in ('contents', 'contentsj') },
+		'contents': capture.orig_pane['contents'],
+		'contentsj': capture.orig_pane['contentsj'],
+		'copy_data': capture.copy_data,
+		'disp_copy_map': capture.disp_copy_map,
+		'copy_disp_map': capture.copy_disp_map,
+		'display_content_lines': capture.display_content_lines,
+		'batches': {
+			key : [ [ (m.tier, m.start, m.end) for m in batch ] for batch in batches ]
+			for key, batches in capture.cache.items() if key[0] == 'quickcopy-batches'
+		}
+	}
+	# Written to a temporary file first so a reader never sees a partial file
+	tmppath = f'{path}.{os.getpid()}.tmp'
+	with open(tmppath, 'wb') as f:
+		marshal.dump(saved, f)
+	os.replace(tmppath, path)
+	# Remove captures of panes that have been closed or left alone for a long time
+	precapture_dir = os.path.dirname(path)
+	now = time.time()
+	for fn in os.listdir(precapture_dir):
+		fpath = os.path.join(precapture_dir, fn)
+		try:
+			if now - os.stat(fpath).st_mtime > precapture_max_age:
+				os.unlink(fpath)
+		except OSError:
+			pass
+
+def run_precapture(target):
+	# Captures the pane and arranges its quickcopy and quickopen matches ahead of time, for the next action on the
+	# pane to use if the pane hasn't changed by then.  Run in the background by the tmux hooks that copytk.tmux
+	# sets when @copytk-precapture is on.
+	capture_time = time.time()
+	pane = get_pane_info(target)
+	path = get_precapture_path(pane)
+	if path == None: return
+	saved = read_precapture(path)
+	if saved != None and precapture_is_current(saved, pane):
+		log('saved capture is still current')
+		return
+	capture = PaneCapture(target, pane)
+	for options_prefix in ( '@copytk-quickcopy-', '@copytk-quickopen-' ):
+		qc = make_headless_quickcopy(capture, options_prefix)
+		if len(qc.tier_exprs) > 0:
+			# Arrange every batch, since the work is done in the background
+			list(qc.get_match_batches())
+	save_precapture(capture, capture_time, path)
+
+def get_pane_capture(target):
+	# Captures the target pane, or uses the capture saved in the background by the precapture action if the pane
+	# is unchanged since then
+	if not str2bool(get_tmux_option('@copytk-precapture', 'off')):
+		return PaneCapture(target)
+	pane = get_pane_info(target)
+	path = get_precapture_path(pane)
+	if path != None:
+		with trace_span('load_precapture'):
+			saved = read_precapture(path)
+			if saved != None and precapture_is_current(saved, pane):
+				log('using saved capture')
+				return PaneCapture(target, pane, saved)
+	return PaneCapture(target, pane)
+
+def run_internal_action():
+	# Runs the action inside the hidden pane.  Does not clean up the hidden pane.
+	os.environ.setdefault('ESCDELAY', '10') # lower curses pause on escape
+	action_runner = get_action_runner(args.action)
+	screen_wrapper = curses.wrapper
+	if get_tmux_option('@copytk-renderer', 'curses') == 'ansi':
+		import copytk_ansi
+		screen_wrapper = copytk_ansi.wrapper
+	if args.sticky or args.action == 'sticky':
+		screen_wrapper(run_sticky)
+	elif action_runner:
+		screen_wrapper(action_runner)
+	else:
+		print('Invalid action')
+		exit(1)
+	# Make sure any copy running concurrently with the flash has finished
+	wait_background_tasks()
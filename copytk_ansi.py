@@ -0,0 +1,143 @@
+# Tmux Copy Toolkit
+# (C) Chris Breneman 2021
+#
+# A lightweight stand-in for a curses window that draws with raw ANSI escape sequences.  It supports the
+# part of the curses window interface the actions use.  Each frame is composed as one string of cursor
+# positioned writes and sent with a single write on refresh, and keys are read with the tty in raw mode.
+
+import os
+import select
+import signal
+import termios
+import tty
+
+from copytk_widths import cell_slice
+
+# curses.color_pair() keeps the pair number in these bits of the attribute
+pair_shift = 8
+
+class AnsiScreen:
+
+	def __init__(self, fd_in=0, fd_out=1):
+		self.fd_in = fd_in
+		self.fd_out = fd_out
+		self.pairs = {}
+		self.pending = []
+		self.inbuf = b''
+		self.escdelay = int(os.environ.get('ESCDELAY', '10')) / 1000
+		self.size = self._get_size()
+		# Resizes are reported through a pipe so a read waiting on keys can be woken up
+		self.resize_r, self.resize_w = os.pipe()
+		os.set_blocking(self.resize_w, False)
+		self.old_sigwinch = signal.signal(signal.SIGWINCH, self._on_resize)
+		self.old_tty = termios.tcgetattr(fd_in)
+		tty.setraw(fd_in)
+		# Alternate screen, hidden cursor and no autowrap, as curses leaves the terminal
+		self._write('\x1b[?1049h\x1b[?25l\x1b[?7l\x1b[0m\x1b[2J')
+
+	def close(self):
+		self._write('\x1b[0m\x1b[?7h\x1b[?25h\x1b[?1049l')
+		termios.tcsetattr(self.fd_in, termios.TCSAFLUSH, self.old_tty)
+		signal.signal(signal.SIGWINCH, self.old_sigwinch)
+		os.close(self.resize_r)
+		os.close(self.resize_w)
+
+	def _get_size(self):
+		size = os.get_terminal_size(self.fd_out)
+		return (size.lines, size.columns)
+
+	def _on_resize(self, signum, frame):
+		try:
+			os.write(self.resize_w, b'r')
+		except OSError:
+			pass
+
+	def _write(self, s):
+		data = s.encode('utf-8')
+		while data:
+			n = os.write(self.fd_out, data)
+			data = data[n:]
+
+	def init_pair(self, index, fg, bg):
+		# Colors are curses color numbers, which are the ANSI color numbers, or -1 for the default
+		self.pairs[index] = '\x1b[0;' + ('39' if fg < 0 else str(30 + fg)) + ';' + ('49' if bg < 0 else str(40 + bg)) + 'm'
+
+	def color_pair(self, index):
+		return index << pair_shift
+
+	def getmaxyx(self):
+		return self.size
+
+	def clear(self):
+		self.pending = [ '\x1b[0m\x1b[2J' ]
+
+	def addstr(self, y, x, s, attr=0):
+		# Text past the right edge (in cells) is dropped rather than wrapped
+		rows, cols = self.size
+		if y < 0 or y >= rows or x < 0 or x >= cols:
+			return
+		s = cell_slice(s, 0, cols - x)
+		sgr = self.pairs.get(attr >> pair_shift) if attr else None
+		if sgr:
+			self.pending.append(f'\x1b[{y + 1};{x + 1}H{sgr}{s}\x1b[0m')
+		else:
+			self.pending.append(f'\x1b[{y + 1};{x + 1}H{s}')
+
+	def refresh(self):
+		if self.pending:
+			self._write(''.join(self.pending))
+			self.pending = []
+
+	def _read_byte(self, timeout=None):
+		# Returns the next input byte, or None on timeout or a resize
+		if not self.inbuf:
+			ready = select.select([ self.fd_in, self.resize_r ], [], [], timeout)[0]
+			if self.resize_r in ready or self.fd_in not in ready:
+				return None
+			self.inbuf = os.read(self.fd_in, 1024)
+		c = self.inbuf[0]
+		self.inbuf = self.inbuf[1:]
+		return c
+
+	def getkey(self):
+		# Returns keys like curses does: a character, '^X' for control keys, or a KEY_ name
+		c = self._read_byte()
+		if c == None:
+			os.read(self.resize_r, 1024)
+			self.size = self._get_size()
+			return 'KEY_RESIZE'
+		if c == 0x1b:
+			# A lone escape, or the start of an escape sequence for a function key
+			n = self._read_byte(self.escdelay)
+			if n == None:
+				return '\x1b'
+			if n in b'[O':
+				while True:
+					n = self._read_byte(self.escdelay)
+					if n == None or 0x40 <= n <= 0x7e:
+						break
+			return 'KEY_UNKNOWN'
+		if c == 0x0d or c == 0x0a:
+			return '\n'
+		if c == 0x7f:
+			return 'KEY_BACKSPACE'
+		if c < 0x20:
+			return '^' + chr(c + 0x40)
+		# Multibyte UTF-8 characters
+		data = bytes([ c ])
+		extra = 1 if c >= 0xc0 else 0
+		extra += 1 if c >= 0xe0 else 0
+		extra += 1 if c >= 0xf0 else 0
+		for i in range(extra):
+			n = self._read_byte(self.escdelay)
+			if n == None: break
+			data += bytes([ n ])
+		return data.decode('utf-8', errors='replace')
+
+def wrapper(fn, *args):
+	# Like curses.wrapper(), with an AnsiScreen on the process's terminal
+	screen = AnsiScreen()
+	try:
+		return fn(screen, *args)
+	finally:
+		screen.close()
@@ -0,0 +1,281 @@
+# Tmux Copy Toolkit
+# (C) Chris Breneman 2021
+#
+# Hand-written scanners for built-in quickcopy presets.  A scanner returns exactly the (start, end) spans
+# that re.finditer() over the preset's regex would, without the regex engine's backtracking.
+
+import re
+
+# Chars that can delimit a url (the regex's [][\s:=,#"{}()'] leader and follower), apart from whitespace
+url_delimiters = '[]:=,#"{}()\''
+ascii_letters = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+ascii_alnum = ascii_letters + '0123456789'
+
+# Hostname label chars, credential chars and digits
+url_hchars_re = re.compile(r'[\w-]*')
+url_user_re = re.compile(r'[a-zA-Z0-9_]*')
+url_password_re = re.compile(r'[a-zA-Z0-9_-]*')
+url_digits_re = re.compile(r'[0-9]*')
+# Runs of the chars in a path, query string or fragment token
+url_token_run_re = re.compile(r'[\w.~%/&-]+')
+url_token_chars_re = re.compile(r'[\w.~%/&-]*')
+# The chars a query string or fragment can contain after the ? or #
+url_query_chars_re = re.compile(r'[\w.~%/&=()#-]*')
+# A query string and/or fragment of key=value pairs without parens or empty keys or values
+url_simple_query_re = re.compile(r'(?:\?[\w.~%/-]+(?:=[\w.~%/-]+)?(?:&[\w.~%/-]+(?:=[\w.~%/-]+)?)*)?(?:#[\w.~%/-]+(?:=[\w.~%/-]+)?(?:&[\w.~%/-]+(?:=[\w.~%/-]+)?)*)?')
+
+def is_url_delimiter(c):
+	return c in url_delimiters or c.isspace()
+
+def url_serv_ends(data, c):
+	# Where the hostname or IP address (the servname) starting at c can end and still be followed by
+	# the rest of a url, in the order the regex tries them.  Within a run of hostname chars or digits only
+	# the end of the run can be followed by anything, so each alternative contributes at most one end.
+	n = len(data)
+	ends = []
+	# Hostname: any number of "label." then a final label starting with a letter
+	q = c
+	while q < n and data[q] in ascii_alnum:
+		r = url_hchars_re.match(data, q + 1).end()
+		if r < n and data[r] == '.':
+			q = r + 1
+		else:
+			break
+	if q < n and data[q] in ascii_letters:
+		ends.append(url_hchars_re.match(data, q + 1).end())
+	# IP address: four octets of 1-3 digits, 3 digit octets starting with 0-2
+	q = c
+	for i in range(4):
+		k = url_digits_re.match(data, q).end()
+		if k == q or k - q > 3 or (k - q == 3 and data[q] not in '012'):
+			break
+		if i == 3:
+			ends.append(k)
+		elif k < n and data[k] == '.':
+			q = k + 1
+		else:
+			break
+	return ends
+
+def url_follower(data, i):
+	# Returns i if a url can end there: at the end of the data (or before a final newline), or a delimiter
+	n = len(data)
+	if i == n or (i == n - 1 and data[i] == '\n'):
+		return i
+	return i if is_url_delimiter(data[i]) else None
+
+def url_query_end(data, lo):
+	# Matches the optional query string and fragment of a url from lo (a ? or #) and the follower after
+	# them.  Returns the end of the url, or None.
+	#
+	# The regex's query string and fragment are (kv&)*kv? where kv is token+(=token?)?, and tokens can
+	# contain & and be split into smaller tokens, which the regex engine backtracks through exponentially.
+	# Instead, working back from the last char they could contain, this computes for every position the
+	# end of the url the regex would find if the remainder of each construct started there (the tables,
+	# indexed from lo).  Among the ends of token+ the regex tries longer ones first, so each "first end
+	# that completes" is found from the one after it.
+	# Table values are ends of the url (never 0) and None means there's no completion.
+	z = url_query_chars_re.match(data, lo + 1).end()
+	if url_follower(data, z) and url_simple_query_re.fullmatch(data, lo, z):
+		# Simple key=value pairs: the url extends to the end of them
+		return z
+	L = z - lo
+	N = L + 1
+	seg = data[lo:z]
+	# tend[i]: end of the run of token chars ([\w.~%/&-]) starting at i
+	tend = list(range(N + 1))
+	for m in url_token_run_re.finditer(seg):
+		s, e = m.span()
+		tend[s:e] = [ e ] * (e - s)
+	# nxt[i]: end of the token char or parenthesized group at i.  token+ matches exactly the chains of these.
+	nxt = [ None ] * N
+	for i in range(L):
+		if tend[i] > i:
+			nxt[i] = i + 1
+		elif seg[i] == '(':
+			k = tend[i + 1]
+			if k < L and seg[k] == ')':
+				nxt[i] = k + 1
+	# The fragment tables are only needed after the first #, and the & tables if there's an & after that
+	f_lo = seg.find('#')
+	f_lo = N if f_lo == -1 else f_lo
+	f_amp = seg.find('&', f_lo) != -1
+	q_lo = 0 if seg[0] == '?' else N
+	q_amp = seg.find('&', q_lo) != -1
+
+	def token_first(q, d, run, chain):
+		# First completion over the ends of a single token starting at q: the ends within the run of token
+		# chars (longest first), then those after groups of parens (longest first)
+		r = run[q]
+		if r != None:
+			return r
+		r = tend[q]
+		if r < L and seg[r] == '(' and nxt[r] != None:
+			e = nxt[r]
+			return chain[e] or d[e]
+		return None
+
+	def step(i, c, n1, d, run, chain, g, kvc):
+		# Fills in the tables for continuation d at i:
+		#   run[i]: first completion over the ends of the token char run after i, longest first
+		#   chain[i]: first completion over the ends of the chain after i, longest first
+		#   g[i]: first completion of (=token?)? at i
+		#   kvc[i]: first completion of a kv (token+(=token?)?) starting at i
+		t = tend[i]
+		if t == i + 1:
+			run[i] = d[i + 1]
+		elif t > i:
+			run[i] = run[i + 1] or d[i + 1]
+		if n1 != None:
+			chain[i] = chain[n1] or d[n1]
+			kvc[i] = kvc[n1] or g[n1]
+		if c == '=':
+			g[i] = token_first(i + 1, d, run, chain) or d[i + 1] or d[i]
+		else:
+			g[i] = d[i]
+
+	def tables(count, needed=True):
+		return [ [ None ] * N if needed else None for j in range(count) ]
+
+	fv, frag, qs = tables(3)
+	# Fragment: kv? and (kv&)*kv?, & then (kv&)*kv?, and the tables for the continuations of each
+	opt_f, star_f, run_f, chain_f, g_f, kvc_f = tables(6, f_lo < N)
+	amp_f, run_af, chain_af, g_af, kvc_af = tables(5, f_amp)
+	# Query string
+	opt_q, star_q, run_q, chain_q, g_q, kvc_q = tables(6, q_lo < N)
+	amp_q, run_aq, chain_aq, g_aq, kvc_aq = tables(5, q_amp)
+
+	for i in range(L, -1, -1):
+		c = seg[i] if i < L else ''
+		n1 = nxt[i] if i < L else None
+		fv[i] = url_follower(data, lo + i)
+		# Optional fragment, then the follower
+		if i > f_lo:
+			step(i, c, n1, fv, run_f, chain_f, g_f, kvc_f)
+			opt_f[i] = kvc_f[i] or fv[i]
+			if f_amp:
+				amp_f[i] = star_f[i + 1] if c == '&' else None
+				step(i, c, n1, amp_f, run_af, chain_af, g_af, kvc_af)
+				star_f[i] = kvc_af[i] or opt_f[i]
+			else:
+				star_f[i] = opt_f[i]
+		frag[i] = (star_f[i + 1] if c == '#' else None) or fv[i]
+		# Optional query string, then the fragment
+		if i > q_lo:
+			step(i, c, n1, frag, run_q, chain_q, g_q, kvc_q)
+			opt_q[i] = kvc_q[i] or frag[i]
+			if q_amp:
+				amp_q[i] = star_q[i + 1] if c == '&' else None
+				step(i, c, n1, amp_q, run_aq, chain_aq, g_aq, kvc_aq)
+				star_q[i] = kvc_aq[i] or opt_q[i]
+			else:
+				star_q[i] = opt_q[i]
+		qs[i] = (star_q[i + 1] if c == '?' else None) or frag[i]
+	return qs[0]
+
+def match_url(data, s, p):
+	# Returns the end of the url whose protocol starts at s and whose :// is at p, or None.  None of the
+	# parts after the :// can contain a : (other than before a port), so the text looked at for each url
+	# never overlaps the next one and the whole scan is linear.
+	base = p + 3
+	n = len(data)
+	# Optional credentials.  Only a whole run of user (and password) chars can be followed by the @.
+	servstarts = []
+	k = url_user_re.match(data, base).end()
+	if k > base and k < n:
+		if data[k] == '@':
+			servstarts.append(k + 1)
+		elif data[k] == ':':
+			k2 = url_password_re.match(data, k + 1).end()
+			if k2 > k + 1 and k2 < n and data[k2] == '@':
+				servstarts.append(k2 + 1)
+	servstarts.append(base)
+	# Where the path can begin: after the servname and optional port, in the order the regex tries them
+	starts = []
+	for c in servstarts:
+		for e in url_serv_ends(data, c):
+			if e < n and data[e] == ':':
+				k = url_digits_re.match(data, e + 1).end()
+				if 1 <= k - e - 1 <= 5:
+					starts.append(k)
+			starts.append(e)
+	if len(starts) == 0:
+		return None
+	query_ends = {}
+
+	def qs_at(i):
+		# Optional query string and fragment, then the follower
+		if i < n and data[i] in '?#':
+			if i not in query_ends:
+				query_ends[i] = url_query_end(data, i)
+			return query_ends[i]
+		return url_follower(data, i)
+
+	def path_at(i):
+		# After the token in the path: optional /, then the query string
+		return (qs_at(i + 1) if i < n and data[i] == '/' else None) or qs_at(i)
+
+	for q in starts:
+		if q < n and data[q] == '/':
+			# The token in the path: the ends within the run of token chars (longest first), then those after
+			# groups of parens (longest first)
+			r = url_token_chars_re.match(data, q + 1).end()
+			for t in range(r, q + 1, -1):
+				e = path_at(t)
+				if e != None:
+					return e
+			if r < n and data[r] == '(':
+				chain = []
+				e = url_token_group_end(data, r)
+				while e != None:
+					chain.append(e)
+					e = url_token_group_end(data, e)
+				for t in reversed(chain):
+					e = path_at(t)
+					if e != None:
+						return e
+			e = path_at(q + 1)
+			if e != None:
+				return e
+		e = qs_at(q)
+		if e != None:
+			return e
+	return None
+
+def url_token_group_end(data, i):
+	# End of the token char or parenthesized group at i, or None
+	if i < len(data):
+		c = data[i]
+		if c == '(':
+			k = url_token_chars_re.match(data, i + 1).end()
+			if k < len(data) and data[k] == ')':
+				return k + 1
+		elif c.isalnum() or c in '_.~%/&-':
+			return i + 1
+	return None
+
+def scan_urls(data):
+	# Yields the spans of the urls preset.  Every url has a :// right after its protocol, so candidates are
+	# found from those; the protocol must be preceded by a delimiter not consumed by the previous match.
+	n = len(data)
+	pos = 0
+	p = data.find('://')
+	while p != -1:
+		s = p
+		while s > 0 and p - s < 7 and data[s - 1] in ascii_alnum:
+			s -= 1
+		if 2 <= p - s <= 6 and data[s] in ascii_letters and ((s == 0 and pos == 0) or (s > pos and is_url_delimiter(data[s - 1]))):
+			end = match_url(data, s, p)
+			if end != None:
+				yield (s, end)
+				# The follower is consumed unless it's the end of the data (or a final newline)
+				if end == n or (end == n - 1 and data[end] == '\n'):
+					pos = end
+				else:
+					pos = end + 1
+		p = data.find('://', p + 1)
+
+# Presets that have a scanner
+preset_scanners = {
+	'urls': scan_urls
+}
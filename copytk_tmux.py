@@ -0,0 +1,394 @@
+# Tmux Copy Toolkit
+# (C) Chris Breneman 2021
+#
+# tmux invocation, options, logging and tracing.  This module is kept light (no curses, regexes or
+# other heavy imports) because it is all the wrapper process needs; actions are in copytk_actions.py.
+
+import os
+import os.path
+import subprocess
+import time
+
+#logdir = '/tmp/copytklog'
+logdir = None
+
+# Full path to tmux so it can be invoked without a shell.  copytk.tmux passes this in with --tmux-path;
+# otherwise it is looked up on first use so the module can be imported without tmux (eg. for benchmarks).
+tmux_command = None
+def get_tmux_command():
+	global tmux_command
+	if tmux_command == None:
+		import shutil
+		tmux_command = shutil.which('tmux')
+		if tmux_command == None:
+			raise Exception('Error finding tmux')
+	return tmux_command
+
+def log_clear():
+	if not logdir: return
+	import shutil
+	shutil.rmtree(logdir, ignore_errors=True)
+	os.makedirs(logdir)
+
+def log(message, fn=None, time=False):
+	if time:
+		trace_mark(message[:80])
+	if not logdir: return
+	if fn == None: fn = 'main.log'
+	if time:
+		from datetime import datetime
+		message = str(datetime.now()) + ': ' + message
+	with open(os.path.join(logdir, fn), 'a') as f:
+		f.write(message + '\n')
+
+# Trace events are always buffered in memory (it's cheap) and written out once at exit by flush_trace()
+# if tracing is enabled with the COPYTK_TRACE_DIR environment variable or the @copytk-trace-dir option.
+# Each event is a tuple of (name, start, duration or None for instant events, args dict).
+trace_events = []
+# Offset to convert perf_counter() values to wall clock time so events from the wrapper and internal processes line up
+trace_clock_offset = time.time() - time.perf_counter()
+
+class trace_span:
+	"""Context manager that records a trace event for the duration of the block."""
+
+	def __init__(self, name, **targs):
+		self.name = name
+		self.targs = targs
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		trace_events.append((self.name, self.start, time.perf_counter() - self.start, self.targs))
+
+def trace_mark(name, **targs):
+	trace_events.append((name, time.perf_counter(), None, targs))
+
+def trace_add_span(name, start, **targs):
+	# Records a span that started at start (from time.perf_counter()) and ends now
+	trace_events.append((name, start, time.perf_counter() - start, targs))
+
+def flush_trace(role, trace_dir=None, trace_format=None, action=None):
+	"""Writes buffered trace events to a new file in the trace directory, if tracing is enabled.
+
+	Arguments:
+		role -- Name of this process's part, 'wrapper' or 'internal'
+		trace_dir -- Directory to write to if the COPYTK_TRACE_DIR environment variable is not set
+		trace_format -- 'chrome' (Chrome trace event format) or 'json'; overridden by COPYTK_TRACE_FORMAT
+		action -- Action name recorded in json format traces
+	"""
+	trace_dir = os.environ.get('COPYTK_TRACE_DIR') or trace_dir
+	if not trace_dir: return
+	import json
+	from datetime import datetime
+	trace_format = os.environ.get('COPYTK_TRACE_FORMAT') or trace_format or 'chrome'
+	trace_dir = os.path.expanduser(trace_dir)
+	os.makedirs(trace_dir, exist_ok=True)
+	pid = os.getpid()
+	if trace_format == 'chrome':
+		data = { 'traceEvents': [
+			{
+				'name': name,
+				'ph': 'i' if dur == None else 'X',
+				'ts': (start + trace_clock_offset) * 1000000,
+				**({ 's': 't' } if dur == None else { 'dur': dur * 1000000 }),
+				'pid': pid,
+				'tid': role,
+				'args': targs
+			}
+			for name, start, dur, targs in trace_events
+		] }
+	else:
+		data = {
+			'role': role,
+			'pid': pid,
+			'action': action,
+			'events': [
+				{ 'name': name, 'start': start + trace_clock_offset, 'duration': dur, 'args': targs }
+				for name, start, dur, targs in trace_events
+			]
+		}
+	fn = os.path.join(trace_dir, f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{pid}-{role}.json')
+	with open(fn, 'w') as f:
+		json.dump(data, f)
+
+# We need to replace the current pane with a pane running the plugin script.
+# Ideally this would be done without messing with any application currently running within the pane.
+# So, create a new window and pane for that application.  If the created window/pane
+# is larger than the current pane, divide it into sections and set the pane to the proper size.
+
+
+def runcmd(command, one=False, lines=False, noblanklines=False):
+	# runs command in shell via popen
+	f = os.popen(command)
+	data = f.read()
+	estatus = f.close()
+	if estatus:
+		raise Exception(f'Command "{command}" exited with status {estatus}')
+	if one or lines: # return list of lines
+		dlines = data.split('\n')
+		if not one and noblanklines:
+			dlines = [ l for l in dlines if len(l) > 0 ]
+	if one: # single-line
+		return dlines[0] if len(dlines) > 0 else ''
+	return dlines if lines else data
+
+class SubprocessTmuxBackend:
+	"""Runs tmux commands by invoking the tmux binary."""
+
+	def run(self, args, sendstdin=None):
+		# Returns a tuple of (exit status, stdout bytes)
+		with subprocess.Popen(
+			[ get_tmux_command() ] + args,
+			shell=False,
+			stdin=subprocess.PIPE if sendstdin != None else subprocess.DEVNULL,
+			stdout=subprocess.PIPE
+		) as proc:
+			recvstdout, _ = proc.communicate(input=sendstdin)
+		return proc.returncode, recvstdout
+
+# All tmux commands go through this backend.  It can be replaced with any object that has a
+# compatible run() method, such as the fake server in _faketmux.py.
+tmux_backend = SubprocessTmuxBackend()
+
+def runtmux(args, one=False, lines=False, noblanklines=False, sendstdin=None):
+	args = [ str(a) for a in args ]
+	log('run tmux: ' + ' '.join(args))
+	if sendstdin != None and isinstance(sendstdin, str):
+		sendstdin = bytearray(sendstdin, 'utf8')
+	with trace_span('tmux', command=' '.join(args)[:100]):
+		returncode, recvstdout = tmux_backend.run(args, sendstdin)
+	if returncode != 0:
+		raise Exception(f'tmux {" ".join(args)} exited with status {returncode}')
+	log('tmux returned')
+	data = recvstdout.decode('utf8')
+	if one or lines: # return list of lines
+		dlines = data.split('\n')
+		if not one and noblanklines:
+			dlines = [ l for l in dlines if len(l) > 0 ]
+	if one: # single-line
+		return dlines[0] if len(dlines) > 0 else ''
+	return dlines if lines else data
+
+def runshellcommand(command, sendstdin=None, raisenonzero=True):
+	log('run shell command: ' + command, time=True)
+	with subprocess.Popen(
+		command,
+		shell=True,
+		executable='/bin/bash',
+		stdin=subprocess.PIPE if sendstdin != None else subprocess.DEVNULL,
+		stdout=subprocess.DEVNULL
+	) as proc:
+		if sendstdin != None and isinstance(sendstdin, str):
+			sendstdin = bytearray(sendstdin, 'utf8')
+		proc.communicate(input=sendstdin)
+		if proc.returncode != 0 and raisenonzero:
+			raise Exception(f'Command {command} returned exit code {proc.returncode}')
+
+
+def escape_tmux_arg(arg):
+	# tmux takes an argument ending in ';' as the end of a command and drops the ';', unless it is escaped.  tmux
+	# only unescapes that final ';', so '\;' works for any arg, including one that already ends in '\;'.
+	if arg.endswith(';'):
+		return arg[:-1] + '\\;'
+	return arg
+
+def runtmuxmulti(argsets, sendstdin=None):
+	if len(argsets) < 1: return
+	allargs = []
+	for argset in argsets:
+		if len(allargs) > 0:
+			allargs.append(';')
+		allargs.extend(argset)
+	runtmux(allargs, sendstdin=sendstdin)
+
+tmux_options_cache = {}
+def fetch_tmux_options(optmode='g'):
+	if optmode in tmux_options_cache:
+		return tmux_options_cache[optmode]
+	tmuxargs = [ 'show-options' ]
+	if optmode:
+		tmuxargs += [ '-' + optmode ]
+	rows = runtmux(tmuxargs, lines=True, noblanklines=True)
+	opts = {}
+	for row in rows:
+		i = row.find(' ')
+		if i == -1:
+			opts[row] = 'on'
+			continue
+		name = row[:i]
+		val = row[i+1:]
+		# need to process val for quoting and backslash-escapes
+		if len(val) > 1 and val[0] == '"':
+			assert(val[-1] == '"')
+			val = val[1:-1]
+		elif len(val) > 1 and val[0] == "'":
+			assert(val[-1] == "'")
+			val = val[1:-1]
+		if val.find('\\') != -1:
+			rval = ''
+			esc = False
+			for c in val:
+				if esc:
+					rval += c
+					esc = False
+				elif c == '\\':
+					esc = True
+				else:
+					rval += c
+			val = rval
+		opts[name] = val
+	tmux_options_cache[optmode] = opts
+	return opts
+
+def get_tmux_option(name, default=None, optmode='g', aslist=False, userlist=False):
+	opts = fetch_tmux_options(optmode)
+	if aslist:
+		ret = []
+		if name in opts:
+			ret.append(opts[name])
+		i = 0
+		while True:
+			if userlist:
+				lname = name + '-' + str(i)
+			else:
+				lname = name + '[' + str(i) + ']'
+			if lname not in opts: break
+			ret.append(opts[lname])
+			i += 1
+		if len(ret) == 0 and default != None:
+			if isinstance(default, list):
+				return default
+			else:
+				return [ default ]
+		return ret
+	else:
+		return opts.get(name, default)
+
+def str2bool(s):
+	return str(s).lower() not in ( '', 'off', 'no', 'false', '0' )
+
+def capture_pane_contents(target=None, opts=None):
+	args = [ 'capture-pane', '-p' ]
+	if opts:
+		args += opts
+	if target != None:
+		args += [ '-t', target ]
+	return runtmux(args)[:-1]
+
+def capture_pane_contents_mapped(target=None, opts=None):
+	# Like capture_pane_contents(), but tmux puts the capture in a paste buffer and saves it to a file
+	# (in tmpfs if available) instead of writing it through a pipe.  The file is memory-mapped rather
+	# than read, and the raw bytes are returned without decoding, as a read-only memoryview.
+	import mmap
+	import tempfile
+	tmpdir = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+	fd, path = tempfile.mkstemp(prefix='copytk-capture-', dir=tmpdir)
+	bufname = 'copytk-capture-' + str(os.getpid())
+	args = [ 'capture-pane', '-b', bufname ]
+	if opts:
+		args += opts
+	if target != None:
+		args += [ '-t', target ]
+	try:
+		runtmux(args + [ ';', 'save-buffer', '-b', bufname, path, ';', 'delete-buffer', '-b', bufname ])
+		size = os.fstat(fd).st_size
+		if size == 0:
+			return memoryview(b'')
+		# The mapping stays valid after the file is closed and removed
+		return memoryview(mmap.mmap(fd, 0, access=mmap.ACCESS_READ))[:size - 1]
+	finally:
+		os.close(fd)
+		os.unlink(path)
+
+def tmux_version_at_least(version, major, minor):
+	# version is tmux's version string, like '3.3a' or 'next-3.4'.  Development builds without a number count as
+	# new, and an empty version (from a tmux too old to report it) as old.
+	if version == '':
+		return False
+	number = version.split('-')[-1]
+	if not number[:1].isdigit():
+		return True
+	parts = [ int(''.join(( c for c in part if c.isdigit() )) or 0) for part in number.split('.') ] + [ 0 ]
+	return (parts[0], parts[1]) >= (major, minor)
+
+def get_pane_info(target=None, capture=False, capturej=False, mapped=False):
+	args = [ 'display-message', '-p' ]
+	if target != None:
+		args += [ '-t', target ]
+	args += [ '#{session_id} #{window_id} #{pane_id} #{pane_width} #{pane_height} #{window_zoomed_flag} #{cursor_x} #{cursor_y} #{copy_cursor_x} #{copy_cursor_y} #{pane_mode} #{scroll_position} #{history_size} #{window_activity} #{pid} #{version} #{@copytk-trace-format} #{@copytk-trace-dir}' ]
+	r = runtmux(args, one=True).split(' ', 17)
+	try:
+		cursorpos = (int(r[6]), int(r[7]))
+	except:
+		cursorpos = (0, 0)
+	try:
+		copycursorpos = (int(r[8]), int(r[9]))
+	except:
+		copycursorpos = (0, 0)
+	mode = r[10]
+	rdict = {
+		'session_id': r[0],
+		'window_id': r[1],
+		'window_id_full': r[0] + ':' + r[1],
+		'pane_id': r[2],
+		'pane_id_full': r[0] + ':' + r[1] + '.' + r[2],
+		'pane_size': (int(r[3]), int(r[4])), # (width, height)
+		'zoomed': bool(int(r[5])),
+		'cursor': copycursorpos if mode == 'copy-mode' else cursorpos,
+		'scroll_position': int(r[11]) if r[11] != '' else None,
+		'mode': mode,
+		'history_size': r[12],
+		'window_activity': r[13],
+		'server_pid': r[14],
+		# Empty on versions of tmux without the version format
+		'tmux_version': r[15],
+		# Tracing options are fetched here so the wrapper doesn't need a separate call for them
+		'trace_format': r[16],
+		'trace_dir': r[17]
+	}
+	capture_pane_info_contents(rdict, capture, capturej, mapped)
+	return rdict
+
+def capture_pane_info_contents(rdict, capture=False, capturej=False, mapped=False):
+	# Adds the captured pane contents to the pane info returned by get_pane_info()
+	capture_opts = []
+	if rdict['mode'] == 'copy-mode' and rdict['scroll_position'] != None and rdict['scroll_position'] > 0:
+		capture_opts += [ '-S', str(-rdict['scroll_position']), '-E', str(-rdict['scroll_position'] + rdict['pane_size'][1] - 1) ]
+	if capture:
+		# The "normal" pane capture includes "hard" newlines at line wraps and truncates trailing spaces
+		with trace_span('capture'):
+			rdict['contents'] = capture_pane_contents(rdict['pane_id_full'], capture_opts)
+	if capturej:
+		# The "-J" pane capture includes trailing spaces and does not have newlines for wrapping
+		with trace_span('capture', joined=True):
+			if mapped:
+				rdict['contentsj_mapped'] = capture_pane_contents_mapped(rdict['pane_id_full'], [ '-J' ] + capture_opts)
+			else:
+				rdict['contentsj'] = capture_pane_contents(rdict['pane_id_full'], [ '-J' ] + capture_opts)
+
+def create_window_pane_of_size(size):
+	# Create a new window in the background
+	window_id_full = runtmux([ 'new-window', '-dP', '-F', '#{session_id}:#{window_id}', '/bin/cat' ], one=True)
+	# Get the information about the new pane just created
+	pane = get_pane_info(window_id_full)
+	# If the width is greater than the target width, do a vertical split.
+	# Note that splitting reduces width by at least 2 due to the separator
+	tmuxcmds = []
+	resize = False
+	if pane['pane_size'][0] > size[0] + 1:
+		tmuxcmds.append([ 'split-window', '-t', pane['pane_id_full'], '-hd', '/bin/cat' ])
+		resize = True
+	# If too tall, do a horizontal split
+	if pane['pane_size'][1] > size[1] + 1:
+		tmuxcmds.append([ 'split-window', '-t', pane['pane_id_full'], '-vd', '/bin/cat' ])
+		resize = True
+	# Resize the pane to desired size
+	if resize:
+		tmuxcmds.append([ 'resize-pane', '-t', pane['pane_id_full'], '-x', size[0], '-y', size[1] ])
+	if len(tmuxcmds) > 0:
+		runtmuxmulti(tmuxcmds)
+	# Return info
+	pane['pane_size'] = size
+	return pane